@@ -0,0 +1,72 @@
+# bench_import.py
+"""
+Tiempo de arranque: cuánto tarda `import <módulo>` en un intérprete nuevo.
+
+Cada medición lanza `python -c "import X"` en un subproceso (caché de módulos
+vacía) y resta el arranque del intérprete solo. Se informa la mediana de N
+corridas, para comparar antes/después de tocar imports.
+
+Uso:
+  python bench_import.py                      # módulos por defecto, 7 corridas
+  python bench_import.py -n 15 cli device     # módulos elegidos
+  python bench_import.py --detalle cli        # top de -X importtime para 'cli'
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MODULOS = ("main", "cli", "manager", "device", "mqtt_queue", "gen_qr", "trace_monitor")
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+def _medir(codigo, n):
+    tiempos = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-c", codigo], cwd=RAIZ, check=True,
+                       stdout=subprocess.DEVNULL)
+        tiempos.append(time.perf_counter() - t0)
+    return statistics.median(tiempos)
+
+def medir(modulos, n=7):
+    """{modulo: ms} de import en frío, descontado el arranque del intérprete."""
+    base = _medir("pass", n)
+    return base, {m: max(0.0, _medir(f"import {m}", n) - base) * 1000 for m in modulos}
+
+def detalle(modulo, top=15):
+    """Top de imports más lentos (tiempo acumulado) según `python -X importtime`."""
+    r = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                       cwd=RAIZ, capture_output=True, text=True)
+    filas = []
+    for linea in r.stderr.splitlines():
+        if not linea.startswith("import time:") or "|" not in linea:
+            continue
+        partes = [p.strip() for p in linea[len("import time:"):].split("|")]
+        if partes[0].isdigit():
+            filas.append((int(partes[1]), int(partes[0]), partes[2]))
+    filas.sort(reverse=True)
+    lineas = [f"--- {modulo}: top {top} por tiempo acumulado (-X importtime) ---",
+              f"{'acum. ms':>10}{'propio ms':>11}  módulo"]
+    for acum, propio, nombre in filas[:top]:
+        lineas.append(f"{acum / 1000:>10.1f}{propio / 1000:>11.1f}  {nombre}")
+    return "\n".join(lineas)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tiempo de import en frío de los módulos de IoT Alchemy")
+    parser.add_argument("modulos", nargs="*", default=list(MODULOS))
+    parser.add_argument("-n", type=int, default=7, help="corridas por módulo (se usa la mediana)")
+    parser.add_argument("--detalle", metavar="MODULO", help="muestra el top de -X importtime de MODULO")
+    args = parser.parse_args(argv)
+
+    if args.detalle:
+        print(detalle(args.detalle))
+        return
+    base, res = medir(args.modulos, max(1, args.n))
+    print(f"⏱️ Import en frío (mediana de {args.n}; intérprete solo: {base * 1000:.1f} ms)")
+    for m, ms in res.items():
+        print(f"{m:<16}{ms:>8.1f} ms")
+
+if __name__ == "__main__":
+    main()
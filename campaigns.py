@@ -0,0 +1,256 @@
+# campaigns.py
+"""
+Campañas de inyección de fallas a nivel de flota.
+
+Una campaña elige una cohorte (porcentaje y/o filtro) y, entre 'inicio' e
+'inicio + duracion', altera lo que publican esos dispositivos. La falla se
+aplica sobre la vista publicada (build_mqtt_payload), no sobre el estado
+interno de la simulación, por lo que al terminar basta con retirarla de la
+cohorte: los valores reales siguen su curso y la campaña queda revertida.
+"""
+import itertools
+import threading
+import time
+from semillas import flujo
+
+TIPOS_FALLA = ("stuck", "drift", "spike", "dropout", "flapping", "out_of_range")
+
+class CampanaInvalida(ValueError):
+    pass
+
+class Campana:
+    """
+    tipo:
+      - stuck        → el parámetro queda congelado en el valor que tenía al iniciar
+      - drift        → suma 'magnitud' unidades por minuto desde el inicio
+      - spike        → con probabilidad 'prob' por envío suma ±'magnitud' × rango
+      - dropout      → el dispositivo deja de publicar
+      - flapping     → los booleanos alternan en cada 'periodo_s' (un 'parametro' no booleano no aplica)
+      - out_of_range → ráfagas de 'rafaga_s' cada 'periodo_s' con valores fuera de [min, max]
+    parametro: nombre del parámetro afectado (None = todos los que apliquen al tipo)
+    filtro: dict {"plantilla": ..., "prefijo": ..., "apagado": ...} o callable(device) -> bool
+    """
+    _ids = itertools.count(1)  # next() es atómico: se pueden crear campañas desde varios hilos
+
+    def __init__(self, tipo, parametro=None, porcentaje=100.0, filtro=None,
+                 inicio=None, duracion=60.0, magnitud=None, prob=0.1,
+                 periodo_s=10.0, rafaga_s=3.0, nombre=None):
+        if tipo not in TIPOS_FALLA:
+            raise CampanaInvalida(f"tipo de falla desconocido '{tipo}' (válidos: {', '.join(TIPOS_FALLA)})")
+        if not 0 < float(porcentaje) <= 100:
+            raise CampanaInvalida("porcentaje debe estar en (0, 100]")
+        if float(duracion) <= 0:
+            raise CampanaInvalida("duracion debe ser > 0")
+        self.id = next(Campana._ids)
+        self.nombre = nombre or f"{tipo}-{self.id}"
+        self.tipo = tipo
+        self.parametro = parametro
+        self.porcentaje = float(porcentaje)
+        self.filtro = filtro
+        self.inicio = float(inicio) if inicio is not None else time.time()
+        self.duracion = float(duracion)
+        self.magnitud = magnitud
+        self.prob = float(prob)
+        self.periodo_s = max(0.1, float(periodo_s))
+        self.rafaga_s = max(0.0, float(rafaga_s))
+
+        self.estado = "pendiente"   # pendiente → activa → finalizada / cancelada
+        self.cohorte = []           # dispositivos afectados
+        self._congelados = {}       # serial -> {param: valor} (stuck)
+        self._rng = flujo("campana", self.id)  # selección de cohorte (hilo del motor)
+        self._rngs = {}                         # serial -> flujo propio ('spike', hilo del dispositivo)
+
+    @property
+    def fin(self):
+        return self.inicio + self.duracion
+
+    # ----------- Selección de cohorte -----------
+    def _coincide(self, d):
+        f = self.filtro
+        if f is None:
+            return True
+        if callable(f):
+            return bool(f(d))
+        tpl = d.plantilla
+        if "plantilla" in f and (tpl is None or tpl.nombre_archivo != f["plantilla"]):
+            return False
+        if "prefijo" in f and not d.serial.startswith(f["prefijo"]):
+            return False
+        if "apagado" in f and bool(d.apagado) != bool(f["apagado"]):
+            return False
+        if "serials" in f and d.serial not in f["serials"]:
+            return False
+        return True
+
+    def _afecta(self, d):
+        return self.tipo == "dropout" or bool(self._claves(d))
+
+    def seleccionar(self, devices):
+        candidatos = [d for d in devices if self._coincide(d) and self._afecta(d)]
+        if self.porcentaje >= 100 or not candidatos:
+            return candidatos
+        n = max(1, round(len(candidatos) * self.porcentaje / 100.0))
+        return self._rng.sample(candidatos, n)
+
+    def _claves(self, d):
+        """Parámetros de 'd' a los que aplica esta campaña."""
+        rules = d.param_rules
+        if self.parametro is not None:
+            k = self.parametro
+            if k not in d.parametros:
+                return ()
+            if self.tipo == "flapping":
+                # solo se alternan booleanos: un parámetro numérico no entra en la cohorte
+                r = rules.get(k)
+                es_bool = r.es_bool if r is not None else isinstance(d.parametros[k], bool)
+                if not es_bool:
+                    return ()
+            return (k,)
+        if self.tipo == "flapping":
+            return tuple(k for k, r in rules.items() if r.es_bool)
+        return tuple(k for k, r in rules.items() if r.es_float or r.es_int)
+
+    # ----------- Activación / reversión en bloque -----------
+    def activar(self, devices):
+        self.cohorte = self.seleccionar(devices)
+        if self.tipo == "stuck":
+            self._congelados = {
+                d.serial: {k: d.parametros.get(k) for k in self._claves(d)} for d in self.cohorte
+            }
+        elif self.tipo == "spike":
+            # un flujo por dispositivo: el resultado no depende del orden de los hilos
+            self._rngs = {d.serial: flujo("campana", self.id, d.serial) for d in self.cohorte}
+        for d in self.cohorte:
+            d.fallas = d.fallas + (self,)
+        self.estado = "activa"
+        return len(self.cohorte)
+
+    def revertir(self, estado="finalizada"):
+        for d in self.cohorte:
+            d.fallas = tuple(f for f in d.fallas if f is not self)
+        self._congelados = {}
+        self._rngs = {}
+        self.estado = estado
+
+    # ----------- Aplicación por envío -----------
+    def suprime_publicacion(self):
+        return self.tipo == "dropout"
+
+    def aplicar(self, d, params, now):
+        """Altera 'params' (copia de la vista publicada de 'd')."""
+        tipo = self.tipo
+        if tipo == "dropout":
+            return
+        if tipo == "stuck":
+            params.update(self._congelados.get(d.serial, {}))
+            return
+
+        rules = d.param_rules
+        elapsed = now - self.inicio
+        rng = self._rngs.get(d.serial) if tipo == "spike" else None
+        if tipo == "spike" and rng is None:
+            return
+        for k in self._claves(d):
+            v = params.get(k)
+            r = rules.get(k)
+            if tipo == "flapping":
+                if int(elapsed / self.periodo_s) % 2:
+                    params[k] = not bool(v)
+                continue
+            if not isinstance(v, (int, float)) or isinstance(v, bool):
+                continue
+            span = (r.max - r.min) if r is not None and (r.es_float or r.es_int) else abs(v) or 1.0
+            if tipo == "drift":
+                rate = self.magnitud if self.magnitud is not None else span * 0.05
+                params[k] = _tipar(r, v + rate * elapsed / 60.0)
+            elif tipo == "spike":
+                if rng.random() < self.prob:
+                    mag = self.magnitud if self.magnitud is not None else 1.0
+                    params[k] = _tipar(r, v + rng.choice((-1, 1)) * mag * span)
+            elif tipo == "out_of_range":
+                if elapsed % self.periodo_s < self.rafaga_s:
+                    mag = self.magnitud if self.magnitud is not None else 0.5
+                    lo = r.min if r is not None and (r.es_float or r.es_int) else v
+                    hi = r.max if r is not None and (r.es_float or r.es_int) else v
+                    par = int(elapsed / self.periodo_s) % 2
+                    params[k] = _tipar(r, hi + mag * span if par == 0 else lo - mag * span)
+
+    def resumen(self):
+        return (f"#{self.id} {self.nombre} [{self.estado}] tipo={self.tipo} "
+                f"param={self.parametro or '*'} cohorte={len(self.cohorte)} "
+                f"inicio={time.strftime('%H:%M:%S', time.localtime(self.inicio))} duracion={self.duracion:g}s")
+
+def _tipar(rule, v):
+    if rule is not None and rule.es_int:
+        return int(round(v))
+    return round(v, 3)
+
+class MotorCampanas:
+    """
+    Programa campañas sobre la flota de un DevicesManager. Un único hilo
+    duerme hasta el próximo inicio/fin y activa o revierte cohortes completas.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.campanas = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def programar(self, campana):
+        with self._lock:
+            self.campanas.append(campana)
+        self._asegurar_hilo()
+        self._wake.set()
+        return campana
+
+    def cancelar(self, campana_id):
+        with self._lock:
+            c = next((c for c in self.campanas if c.id == campana_id), None)
+            if c is None or c.estado in ("finalizada", "cancelada"):
+                return False
+            if c.estado == "activa":
+                c.revertir("cancelada")
+            else:
+                c.estado = "cancelada"
+        self._wake.set()
+        return True
+
+    def listar(self):
+        return list(self.campanas)
+
+    def _asegurar_hilo(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="campanas", daemon=True)
+            self._thread.start()
+
+    def procesar(self, now=None):
+        """Activa/revierte lo que corresponda a 'now'. Devuelve segundos hasta el próximo evento."""
+        now = now if now is not None else time.time()
+        proximo = None
+        with self._lock:
+            for c in self.campanas:
+                if c.estado == "pendiente" and now >= c.inicio:
+                    if now >= c.fin:
+                        c.estado = "finalizada"
+                        continue
+                    n = c.activar(self.manager.list_devices())
+                    print(f"🧪 Campaña {c.nombre} activa sobre {n} dispositivos")
+                if c.estado == "activa" and now >= c.fin:
+                    c.revertir()
+                    print(f"🧪 Campaña {c.nombre} finalizada y revertida")
+                if c.estado == "pendiente":
+                    t = c.inicio
+                elif c.estado == "activa":
+                    t = c.fin
+                else:
+                    continue
+                proximo = t if proximo is None else min(proximo, t)
+        return None if proximo is None else max(0.0, proximo - now)
+
+    def _loop(self):
+        while True:
+            self._wake.clear()
+            espera = self.procesar()
+            self._wake.wait(espera if espera is not None else 3600)
@@ -1,15 +1,49 @@
 # cli.py
 import time
-from templates_loader import cargar_plantillas
+from config_loader import REGISTRO
 from manager import DevicesManager
-from gen_qr import generar_qr_reclamo
+from campaigns import Campana, TIPOS_FALLA
+from mqtt_queue import listar_colas, cerrar_colas
+from sharding import enrutador
+from profiler import PERFIL
 from utils import reclamar_dispositivo, modificar_dispositivo, listar_dispositivos_backend
 
+TAM_PAGINA = 25
+_VERDADERO = ("si", "sí", "true", "1", "s", "yes")
+_FALSO = ("no", "false", "0", "n")
+
+def _parsear_filtros(raw):
+    """'plantilla=x apagado=si pagina=2' → (filtros, pagina, detalle)."""
+    filtros, pagina, detalle = {}, 1, False
+    for tok in raw.split():
+        if "=" not in tok:
+            raise ValueError(f"filtro sin '=': {tok}")
+        k, v = tok.split("=", 1)
+        k, v = k.strip().lower(), v.strip()
+        if k in ("plantilla", "prefijo"):
+            filtros[k] = v
+        elif k == "pagina":
+            pagina = max(1, int(v))
+        elif k in ("running", "apagado", "inyectado", "reclamado", "detalle"):
+            if v.lower() in _VERDADERO:
+                b = True
+            elif v.lower() in _FALSO:
+                b = False
+            else:
+                raise ValueError(f"valor inválido para {k}: {v} (use si/no)")
+            if k == "detalle":
+                detalle = b
+            else:
+                filtros[k] = b
+        else:
+            raise ValueError(f"filtro desconocido: {k}")
+    return filtros, pagina, detalle
+
 def show_menu():
     print("\n=== IoT Alchemy CLI ===")
     print("1) Listar plantillas")
     print("2) Crear dispositivo desde plantilla")
-    print("3) Listar dispositivos activos")
+    print("3) Consultar dispositivos (filtros, páginas y conteos)")
     print("4) Iniciar simulación de un dispositivo")
     print("5) Detener simulación de un dispositivo")
     print("6) Modificar parámetros de un dispositivo (en vivo-inyeccion de errores)")
@@ -19,13 +53,25 @@ def show_menu():
     print("++++++++++++++ Simulaciones de Front-End ++++++++++++++")
     print("10) Reclamar dispositivo vía HTTP (PowerShell y cURL)")
     print("11) Modificar datos vía HTTP (PowerShell y cURL)")
+    print("++++++++++++++ Administración ++++++++++++++")
+    print("12) Recargar config.json y plantillas ahora")
+    print("13) Guardar snapshot de la flota")
+    print("14) Cargar snapshot de la flota (reinicio en caliente)")
+    print("15) Programar campaña de fallas sobre la flota")
+    print("16) Listar / cancelar campañas de fallas")
+    print("17) Exportar etiquetas QR en lote (sin navegador)")
+    print("18) Estado de las colas MQTT de salida y reparto por broker")
+    print(f"19) {'Detener' if PERFIL.activo else 'Iniciar'} perfilado (fases + pilas de hilos)")
+    print("20) Modo gateway: tasas (mensajes/s vs lecturas/s) y activar/desactivar")
     print("0) Salir")
 
 def iniciar_cli():
-    templates = cargar_plantillas()
     manager = DevicesManager()
+    # Vigila config.json y /templates por mtime y recarga en caliente
+    REGISTRO.iniciar_vigilancia()
 
     while True:
+        templates = REGISTRO.plantillas()
         show_menu()
         opt = input("Opción: ").strip()
         if opt == "1":
@@ -59,17 +105,40 @@ def iniciar_cli():
             except Exception:
                 cnt = 1
 
+            t0 = time.perf_counter()
             created = manager.create_from_template(tpl, count=cnt, serial_custom=serial_custom)
-            for d in created:
+            dt = time.perf_counter() - t0
+            for d in created[:20]:
                 print(f"Creado: {d.serial} (intervalo: {d.interval}s)")
+            if len(created) > 20:
+                print(f"... y {len(created) - 20} más")
+            print(f"{len(created)} dispositivos creados en {dt:.3f}s")
 
         elif opt == "3":
-            devs = manager.list_devices()
-            if not devs:
+            if not manager.devices:
                 print("No hay dispositivos creados.")
-            else:
-                for d in devs:
-                    print(f"- {d.serial} | apagado:{d.apagado} | intervalo:{d.interval}s | params:{d.parametros}")
+                continue
+            raw = input("Filtros (ej: plantilla=sensor_temp prefijo=TMP0 running=si apagado=no "
+                        "inyectado=si reclamado=no pagina=2 detalle=si; ENTER = todos): ").strip()
+            try:
+                filtros, pagina, detalle = _parsear_filtros(raw)
+                ag = manager.agregados(**filtros)
+                total, devs = manager.consultar(offset=(pagina - 1) * TAM_PAGINA, limite=TAM_PAGINA, **filtros)
+            except ValueError as e:
+                print(f"❌ {e}")
+                continue
+            print(f"Total: {ag['total']} | en marcha: {ag['running']} | apagados: {ag['apagado']} | "
+                  f"inyectados: {ag['inyectado']} | reclamados: {ag['reclamado']}")
+            print("Por plantilla:", ", ".join(f"{k or '-'}={v}" for k, v in ag["por_plantilla"].items()) or "-")
+            paginas = max(1, -(-total // TAM_PAGINA))
+            print(f"--- Página {pagina}/{paginas} ---")
+            for d in devs:
+                linea = (f"- {d.serial} | {d.plantilla.nombre_archivo if d.plantilla is not None else '-'} | "
+                         f"running:{d.running} | apagado:{d.apagado} | inyectado:{d.inyectado} | "
+                         f"reclamado:{d.reclamado} | intervalo:{d.interval}s")
+                if detalle:
+                    linea += f" | params:{dict(d.parametros)}"
+                print(linea)
 
         elif opt == "4":
             s = input("Serial del dispositivo a iniciar: ").strip()
@@ -86,8 +155,10 @@ def iniciar_cli():
             if not d:
                 print("No encontrado.")
             else:
-                d.stop()
-                print("Simulación detenida.")
+                if d.stop():
+                    print("Simulación detenida.")
+                else:
+                    print("Detención solicitada; el dispositivo aún no terminó su ciclo.")
 
         elif opt == "6":
             s = input("Serial del dispositivo: ").strip()
@@ -95,7 +166,7 @@ def iniciar_cli():
             if not d:
                 print("No encontrado.")
             else:
-                print("Parámetros actuales:", d.parametros)
+                print("Parámetros actuales:", dict(d.parametros))
                 key = input("Parámetro a modificar: ").strip()
                 if key not in d.parametros:
                     print("Parámetro no existe.")
@@ -119,23 +190,129 @@ def iniciar_cli():
             print("Todas las simulaciones iniciadas.")
 
         elif opt == "8":
-            manager.stop_all()
-            print("Todas las simulaciones detenidas.")
+            fallidos = manager.stop_all(timeout=REGISTRO.get("shutdown_timeout", 5))
+            if not fallidos:
+                print("Todas las simulaciones detenidas.")
 
         elif opt == "9":
             serial = input("Ingrese el serial del dispositivo: ").strip()
+            from gen_qr import generar_qr_reclamo  # qrcode/PIL solo si se usa
             generar_qr_reclamo(serial, templates)
         
+        elif opt == "17":
+            raw = input("Seriales separados por coma (ENTER = todos los dispositivos): ").strip()
+            seriales = [x.strip() for x in raw.split(",") if x.strip()] if raw else list(manager.devices)
+            if not seriales:
+                print("No hay dispositivos creados.")
+                continue
+            formato = input("Formato zip/html (zip): ").strip().lower() or "zip"
+            destino = input("Archivo destino (ENTER = carpeta temporal): ").strip() or None
+            from gen_qr import exportar_qr_lote
+            try:
+                exportar_qr_lote(seriales, templates, destino=destino, formato=formato)
+            except (OSError, ValueError) as e:
+                print(f"❌ Error exportando QR: {e}")
+
         elif opt == "10":
             serial = input("Ingrese el serial del dispositivo: ")
-            reclamar_dispositivo(serial, list(templates.values()))
+            reclamar_dispositivo(serial, templates)
 
         elif opt == "11":
             modificar_dispositivo()
 
+        elif opt == "12":
+            cambios, cambiadas = REGISTRO.refrescar()
+            if not cambios and not cambiadas:
+                print("Sin cambios en config.json ni en plantillas.")
+
+        elif opt in ("13", "14"):
+            default = REGISTRO.get("snapshot_path", "fleet.snap")
+            path = input(f"Archivo de snapshot ({default}): ").strip() or default
+            try:
+                if opt == "13":
+                    manager.save_snapshot(path)
+                else:
+                    manager.load_snapshot(path)
+            except (OSError, ValueError) as e:
+                print(f"❌ Error con el snapshot: {e}")
+
+        elif opt == "15":
+            print("Tipos:", ", ".join(TIPOS_FALLA))
+            tipo = input("Tipo de falla: ").strip()
+            param = input("Parámetro (ENTER = todos los aplicables): ").strip() or None
+            plantilla = input("Filtrar por plantilla (ENTER = toda la flota): ").strip()
+            try:
+                pct = float(input("Porcentaje de la flota (100): ").strip() or "100")
+                en_s = float(input("Iniciar en N segundos (0): ").strip() or "0")
+                dur = float(input("Duración en segundos (60): ").strip() or "60")
+                mag = input("Magnitud (ENTER = por defecto): ").strip()
+                c = Campana(
+                    tipo,
+                    parametro=param,
+                    porcentaje=pct,
+                    filtro={"plantilla": plantilla} if plantilla else None,
+                    inicio=time.time() + en_s,
+                    duracion=dur,
+                    magnitud=float(mag) if mag else None,
+                )
+            except ValueError as e:
+                print(f"❌ Campaña inválida: {e}")
+                continue
+            manager.campanas.programar(c)
+            print(f"Campaña programada: {c.resumen()}")
+
+        elif opt == "16":
+            campanas = manager.campanas.listar()
+            if not campanas:
+                print("No hay campañas.")
+                continue
+            for c in campanas:
+                print(" -", c.resumen())
+            sel = input("ID a cancelar (ENTER = ninguna): ").strip()
+            if sel:
+                try:
+                    ok = manager.campanas.cancelar(int(sel))
+                except ValueError:
+                    ok = False
+                print("Campaña cancelada y revertida." if ok else "No se pudo cancelar.")
+
+        elif opt == "18":
+            colas = listar_colas()
+            if not colas:
+                print("Aún no hay colas MQTT (ningún dispositivo publicó).")
+            for c in colas:
+                print(" -", c.resumen())
+            por_broker, por_backend = enrutador().reparto(manager.devices)
+            if len(por_broker) > 1 or len(por_backend) > 1:
+                print("Reparto por hash consistente (nodo primario):")
+                for nodo, n in sorted(por_broker.items()):
+                    print(f"   broker {nodo}: {n}")
+                for nodo, n in sorted(por_backend.items()):
+                    print(f"   backend {nodo}: {n}")
+
+        elif opt == "19":
+            if PERFIL.activo:
+                PERFIL.detener(REGISTRO.get("profile_path", "perfil.folded"))
+            else:
+                PERFIL.iniciar(REGISTRO.get("profile_interval_ms", 10) / 1000.0)
+
+        elif opt == "20":
+            gws = manager.gateways
+            print(gws.resumen())
+            accion = "Desactivar" if gws.activo else "Activar"
+            if input(f"¿{accion} el modo gateway? (s/N): ").strip().lower() in _VERDADERO:
+                # solo para esta sesión; para dejarlo fijo use "gateway_mode" en config.json
+                gws.configurar(dict(REGISTRO.config(), gateway_mode=not gws.activo))
+                if not gws.activo:
+                    print("📦 Modo gateway desactivado: cada dispositivo vuelve a publicar su mensaje")
+
         elif opt == "0":
             print("Saliendo...")
-            manager.stop_all()
+            if PERFIL.activo:
+                PERFIL.detener(REGISTRO.get("profile_path", "perfil.folded"))
+            REGISTRO.detener_vigilancia()
+            manager.stop_all(timeout=REGISTRO.get("shutdown_timeout", 5))
+            cerrar_colas()
             break
         else:
             print("Opción inválida.")
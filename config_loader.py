@@ -0,0 +1,186 @@
+# config_loader.py
+import os
+import json
+import time
+import threading
+from types import MappingProxyType
+from templates_loader import TEMPLATE_DIR, IndicePlantillas, cargar_plantilla
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+class RegistroConfig:
+    """
+    Registro central y cacheado de config.json y de las plantillas.
+
+    - config()/get() no tocan disco: devuelven la copia en caché (solo lectura).
+    - refrescar() compara mtimes y recarga solo lo que cambió (config y
+      plantillas una a una), luego notifica a los suscriptores.
+    - iniciar_vigilancia() lanza un hilo que llama a refrescar() periódicamente.
+    Sin hilo de vigilancia, config() revisa el mtime como mucho cada
+    'min_check_interval' segundos.
+    """
+
+    def __init__(self, config_path=CONFIG_PATH, template_dir=TEMPLATE_DIR, min_check_interval=1.0):
+        self.config_path = config_path
+        self.template_dir = template_dir
+        self.min_check_interval = min_check_interval
+
+        self._lock = threading.RLock()
+        self._config = None            # MappingProxyType
+        self._config_mtime = None
+        self._plantillas = None        # IndicePlantillas (se reemplaza completo en cada recarga)
+        self._tpl_mtimes = {}          # nombre -> mtime_ns
+        self._last_check = 0.0
+        self._suscriptores = []
+
+        self._watch_thread = None
+        self._watch_stop = threading.Event()
+
+    # ----------- Lectura -----------
+    def config(self):
+        if self._config is None:
+            with self._lock:
+                if self._config is None:
+                    self._recargar_config()
+        elif self._watch_thread is None and time.monotonic() - self._last_check >= self.min_check_interval:
+            self.refrescar(plantillas=False)
+        return self._config
+
+    def get(self, key, default=None):
+        return self.config().get(key, default)
+
+    def plantillas(self):
+        if self._plantillas is None:
+            with self._lock:
+                if self._plantillas is None:
+                    self._recargar_plantillas()
+        return self._plantillas
+
+    # ----------- Recarga -----------
+    def _leer_config(self):
+        try:
+            with open(self.config_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("config.json debe ser un objeto JSON")
+            return data
+        except Exception as e:
+            print(f"⚠️ No se pudo cargar config.json: {e}")
+            return None
+
+    def _recargar_config(self):
+        """Devuelve {clave: nuevo_valor} de lo que cambió (vacío si nada)."""
+        mtime = _mtime(self.config_path)
+        self._last_check = time.monotonic()
+        if self._config is not None and mtime == self._config_mtime:
+            return {}
+        data = self._leer_config()
+        self._config_mtime = mtime
+        if data is None:
+            # Mantiene la última config válida (o vacía si nunca hubo una)
+            if self._config is None:
+                self._config = MappingProxyType({})
+            return {}
+        anterior = self._config or {}
+        cambios = {k: v for k, v in data.items() if anterior.get(k) != v}
+        cambios.update({k: None for k in anterior if k not in data})
+        self._config = MappingProxyType(data)
+        return cambios
+
+    def _recargar_plantillas(self):
+        """Recarga incremental por mtime. Devuelve (cambiadas, eliminadas) como sets de nombres."""
+        actual = self._plantillas
+        mtimes = {}
+        if os.path.isdir(self.template_dir):
+            for archivo in sorted(os.listdir(self.template_dir)):
+                if archivo.endswith(".json"):
+                    nombre = archivo.replace(".json", "")
+                    mtimes[nombre] = _mtime(os.path.join(self.template_dir, archivo))
+
+        eliminadas = {n for n in self._tpl_mtimes if n not in mtimes}
+        pendientes = [n for n, m in mtimes.items() if self._tpl_mtimes.get(n) != m]
+        if actual is not None and not eliminadas and not pendientes:
+            return set(), set()
+
+        nuevo = IndicePlantillas(actual or {})
+        cambiadas = set()
+        for nombre in pendientes:
+            ruta = os.path.join(self.template_dir, nombre + ".json")
+            try:
+                nuevo[nombre] = cargar_plantilla(ruta, nombre)
+                cambiadas.add(nombre)
+            except (OSError, ValueError) as e:
+                # se conserva la versión anterior (si la había)
+                print(f"⚠️ Plantilla inválida '{nombre}.json': {e}")
+            self._tpl_mtimes[nombre] = mtimes[nombre]
+        for nombre in eliminadas:
+            self._tpl_mtimes.pop(nombre, None)
+            if nombre in nuevo:
+                del nuevo[nombre]
+        self._plantillas = nuevo  # swap atómico de la referencia
+        return cambiadas, eliminadas
+
+    def refrescar(self, plantillas=True):
+        """Revisa mtimes, recarga lo cambiado y notifica. Devuelve (cambios_config, plantillas_cambiadas)."""
+        with self._lock:
+            cambios = self._recargar_config()
+            cambiadas, eliminadas = set(), set()
+            if plantillas and self._plantillas is not None:
+                cambiadas, eliminadas = self._recargar_plantillas()
+        if cambios or cambiadas or eliminadas:
+            for cb in list(self._suscriptores):
+                try:
+                    cb(cambios, cambiadas)
+                except Exception as e:
+                    print(f"⚠️ Error aplicando recarga de configuración: {e}")
+        return cambios, cambiadas
+
+    # ----------- Suscripción y vigilancia -----------
+    def suscribir(self, callback):
+        """callback(cambios_config: dict, plantillas_cambiadas: set)"""
+        if callback not in self._suscriptores:
+            self._suscriptores.append(callback)
+
+    def desuscribir(self, callback):
+        if callback in self._suscriptores:
+            self._suscriptores.remove(callback)
+
+    def iniciar_vigilancia(self, periodo=None):
+        if self._watch_thread is not None:
+            return
+        periodo = periodo or self.get("reload_check_interval", 2)
+        self.config()
+        self.plantillas()
+        self._watch_stop.clear()
+
+        def loop():
+            while not self._watch_stop.wait(periodo):
+                try:
+                    self.refrescar()
+                except Exception as e:
+                    print(f"⚠️ Error vigilando configuración: {e}")
+
+        self._watch_thread = threading.Thread(target=loop, name="recarga", daemon=True)
+        self._watch_thread.start()
+
+    def detener_vigilancia(self):
+        if self._watch_thread is None:
+            return
+        self._watch_stop.set()
+        self._watch_thread.join(timeout=1)
+        self._watch_thread = None
+
+# Registro compartido por todo el proceso
+REGISTRO = RegistroConfig()
+
+def get_config():
+    return REGISTRO.config()
+
+def get_plantillas():
+    return REGISTRO.plantillas()
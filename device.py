@@ -1,17 +1,18 @@
 # device.py
 import json
-import os
 import time
 import threading
-import random
-import requests
 import datetime
-from paho.mqtt import publish
+from itertools import repeat
+from types import MappingProxyType
+from mqtt_queue import obtener_cola
+from sharding import enrutador
+from profiler import PERFIL
+from semillas import flujo, generador_np, numpy_opcional, reloj_inicio
 from utils import clamp
+from templates_loader import guess_kind, capability_for_kind, channel_for_kind, compilar_reglas
 
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
-with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-    CONFIG = json.load(f)
+from config_loader import get_config
 
 # -------------------------------
 # Mapas de días y helpers de tiempo
@@ -56,78 +57,63 @@ def _is_time_in_range(t, start, end):
     return t >= start or t <= end
 
 # ------------------------------------
-# Detección de "kind" y capability/canal
+# Valores iniciales (muestreo por lotes)
 # ------------------------------------
-# 1) Kind por prefijo de serial (fallback si no lo da la config)
-KIND_BY_SERIAL_PREFIX = {
-    "LGT0": "luz",
-    "RGD0": "riego",
-    "SHD0": "persiana",
-    "FAN0": "ventilador",
-    "DRL0": "puerta",
-    "TMP0": "termometro",
-    "CAM0": "camara",
-    "PLG0": "enchufe",
-    "LUX0": "sensor_luz",
-    "CO20": "sensor_co2",
-    "SMK0": "sensor_humo",
-    "MOV0": "sensor_mov",
-    "SND0": "sensor_ruido",
-}
-
-# 2) Canal recomendado por kind (coincide con el plan de “canales”)
-CHANNEL_BY_KIND = {
-    "luz": "horarios",
-    "enchufe": "horarios",
-    "camara": "horarios",          # se trata como binario
-    "persiana": "horarios_pos",
-    "cortina": "horarios_pos",
-    "riego": "horarios_riego",
-    "ventilador": "horarios_speed",
-    "puerta": "horarios_lock",
-    "termometro": "horarios_temp",
-    "aire": "horarios_temp",
-    # Sensores → sin programación propia (usa solo intervalo_envio)
-}
-
-# 3) Capability por kind
-CAPABILITY_BY_KIND = {
-    "luz": "binary",
-    "enchufe": "binary",
-    "camara": "binary",
-    "persiana": "position",
-    "cortina": "position",
-    "ventilador": "speed",
-    "puerta": "lock",
-    "riego": "duration",
-    "termometro": "setpoint",
-    "aire": "setpoint",
-    # sensores → "sensor" (solo lectura)
-    "sensor_luz": "sensor",
-    "sensor_co2": "sensor",
-    "sensor_humo": "sensor",
-    "sensor_mov": "sensor",
-    "sensor_ruido": "sensor",
-}
-
-def _guess_kind(serial: str, cfg: dict) -> str:
-    # prioridad: configuracion.kind / configuracion.subtipo → prefijo serial → fallback
-    for key in ("kind", "subtipo"):
-        v = cfg.get(key)
-        if v:
-            return str(v).strip().lower()
-    # por prefijo
-    for pref, kind in KIND_BY_SERIAL_PREFIX.items():
-        if str(serial).startswith(pref):
-            return kind
-    # si no hay pista, asume binario
-    return "luz"
-
-def _capability_for_kind(kind: str) -> str:
-    return CAPABILITY_BY_KIND.get(kind, "binary")
-
-def _channel_for_kind(kind: str) -> str:
-    return CHANNEL_BY_KIND.get(kind, "horarios")
+# Extras que algunos kinds usan (se añaden si la plantilla no los define)
+PARAMETROS_EXTRA = (
+    ("posicion", 0),            # persiana
+    ("velocidad", 0),           # ventilador
+    ("riego_en_curso", False),
+    ("setpoint_c", None),       # termostato/aire
+    ("lock_state", "unlock"),
+)
+
+def _muestrear_iniciales(reglas, n, rng):
+    """
+    Valores iniciales para n dispositivos: una columna (lista de n valores) por regla.
+    Con NumPy disponible se muestrea cada columna en un único llamado vectorizado,
+    con un Generator sembrado desde 'rng' (flujo de la cohorte, ver semillas.py).
+    """
+    columnas = []
+    por_nombre = {}
+    rnd = rng.random
+    # NumPy (opcional) se importa recién con el primer lote
+    np = numpy_opcional() if n > 1 else None
+    gen = generador_np(rng) if np is not None else None
+    now = reloj_inicio()
+    for rule in reglas:
+        mn, mx = rule.min, rule.max
+        senal = rule.senal
+        if senal is not None:
+            # el valor inicial sale del modelo (p.ej. la curva diurna a esta hora)
+            dep = senal.depende_de
+            if dep is not None and dep in por_nombre:
+                col = [rule.acotar(senal.inicial({dep: v}, now, rng)) for v in por_nombre[dep]]
+            else:
+                vacio = {}
+                col = [rule.acotar(senal.inicial(vacio, now, rng)) for _ in range(n)]
+        elif rule.es_float:
+            if gen is not None:
+                col = np.round(gen.uniform(mn, mx, n), 2).tolist()
+            else:
+                span = mx - mn
+                col = [round(mn + span * rnd(), 2) for _ in range(n)]
+        elif rule.es_int:
+            if gen is not None:
+                col = gen.integers(mn, mx + 1, n).tolist()
+            else:
+                span = mx - mn + 1
+                col = [mn + int(span * rnd()) for _ in range(n)]
+        elif rule.es_bool:
+            if gen is not None:
+                col = (gen.random(n) < 0.5).tolist()
+            else:
+                col = [rnd() < 0.5 for _ in range(n)]
+        else:
+            col = [rule.default] * n
+        columnas.append(col)
+        por_nombre[rule.nombre] = col
+    return columnas
 
 # ------------------------------------
 # Simulador
@@ -137,7 +123,8 @@ class DeviceSimulator:
     Publica SOLO por MQTT:
       { "serial_number", "estado", "parametros" }
 
-    Lee por HTTP (GET /dispositivos/<id>) para aplicar configuraciones remotas:
+    Lee por HTTP (GET /dispositivos/<id>) para aplicar configuraciones remotas
+    (o las recibe por MQTT con config_push, quedando HTTP como reconciliación lenta):
       - configuracion.intervalo_envio → self.interval
       - configuracion.encendido (manual) → self.apagado
       - configuracion.modo = manual/horario
@@ -152,47 +139,74 @@ class DeviceSimulator:
         interval=5,
         mqtt_host=None,
         backend_url=None,
-        poll_config_interval=None
+        poll_config_interval=None,
+        plantilla=None,
+        mqtt_port=None,
+        trazar=None,
+        _muestrear=True
     ):
         self.serial = serial
-        self.param_rules = parametros_rules or {}
-        self.mqtt_topic = mqtt_topic or CONFIG.get("mqtt_topic_estado", "dispositivos/estado")
-        self.mqtt_host = mqtt_host or CONFIG.get("mqtt_host", "localhost")
-        self.backend_url = backend_url or CONFIG.get("backend_url")
+        self.plantilla = plantilla
+        # Reglas compiladas (tupla de ReglaParametro); acepta también el dict crudo
+        if parametros_rules is None and plantilla is not None:
+            parametros_rules = plantilla.reglas
+        self.reglas = compilar_reglas(parametros_rules)
+        self.param_rules = {r.nombre: r for r in self.reglas}
+        # Kind base ya resuelto al compilar la plantilla (la config remota puede sobrescribirlo)
+        self.kind = plantilla.kind if plantilla is not None else guess_kind(serial, {})
+        config = get_config()
+        self.mqtt_topic = mqtt_topic or config.get("mqtt_topic_estado", "dispositivos/estado")
+        self.mqtt_host = mqtt_host or config.get("mqtt_host", "localhost")
+        self.mqtt_port = int(mqtt_port or config.get("mqtt_port", 1883))
+        self._cola = None  # cola MQTT compartida del broker (se resuelve al publicar)
+        self._cola_primaria = True  # False mientras se publica en un broker de respaldo
+        self._gateway = None  # gateways.Gateway en modo gateway: publica por lotes
+        self.backend_url = backend_url or config.get("backend_url")
         self.interval = max(1, int(interval))
 
         # Flags e hilos
         self.running = False
         self._thread = None
         self._cfg_thread = None
+        self._stop_evt = None  # threading.Event por arranque: despierta a los hilos al detener
+        # Config empujada por MQTT pendiente de aplicar en el hilo cfg (la última gana)
+        self._cfg_pendiente = None
+        self._cfg_evt = None   # threading.Event por arranque: despierta al hilo cfg
+
+        # Observador de cambios de estado (p.ej. índices del DevicesManager):
+        # callable(device, campo, valor) con campo en running/apagado/inyectado/reclamado
+        self._observador = None
 
         # Estado/params
-        self.apagado = False  # apagado=True -> estado="inactivo"
-        self.parametros = {}
-        for k, rule in self.param_rules.items():
-            mn = rule.get("min", 0)
-            mx = rule.get("max", 1)
-            t = rule.get("tipo")
-            if t in ("float", "double"):
-                self.parametros[k] = round(random.uniform(mn, mx), 2)
-            elif t == "int":
-                self.parametros[k] = random.randint(int(mn), int(mx))
-            elif t == "boolean":
-                self.parametros[k] = random.choice([True, False])
-            else:
-                self.parametros[k] = rule.get("default")
+        self._apagado = False  # apagado=True -> estado="inactivo"
+        # Generador propio (semilla de la corrida + serial), creado al primer uso
+        self._rng = None
+        self._t_sim = None  # reloj simulado de las señales (ver semillas.reloj_inicio)
+        params = {}
+        if _muestrear:  # crear_lote muestrea todo el lote por columnas y lo pisa
+            iniciales = _muestrear_iniciales(self.reglas, 1, flujo("iniciales", serial))
+            params = {rule.nombre: col[0] for rule, col in zip(self.reglas, iniciales)}
 
         # Extras que algunos kinds usan
-        self.parametros.setdefault("posicion", 0)        # persiana
-        self.parametros.setdefault("velocidad", 0)       # ventilador
-        self.parametros.setdefault("riego_en_curso", False)
-        self.parametros.setdefault("setpoint_c", None)   # termostato/aire
-        self.parametros.setdefault("lock_state", "unlock")
+        for k, v in PARAMETROS_EXTRA:
+            params.setdefault(k, v)
+
+        # Estado copy-on-write: _params es una instantánea que NUNCA se muta tras
+        # publicarse; los escritores (hilo de simulación, hilo de config, CLI) crean
+        # un dict nuevo bajo _wlock y reemplazan la referencia. Los lectores
+        # (publish_estado, CLI) solo leen la referencia actual, sin locks.
+        self._wlock = threading.Lock()
+        self._params = params
 
         # Config remota (solo lectura)
-        self.poll_config_interval = max(1, int(poll_config_interval or CONFIG.get("poll_config_interval", 3)))
+        self.poll_config_interval = max(1, int(poll_config_interval or config.get("poll_config_interval", 3)))
         self._device_id = None
+        # Trazado (opt-in): secuencia por dispositivo + marca de envío en cada payload
+        self.trazar = bool(config.get("tracing", False) if trazar is None else trazar)
+        self._seq = 0
         self.inyecciones = {k: False for k in self.param_rules}
+        # Campañas de fallas activas sobre este dispositivo (ver campaigns.py); tupla inmutable
+        self.fallas = ()
 
         # Último encendido sincronizado al backend (solo binarios)
         self._last_encendido_sync = None
@@ -200,45 +214,154 @@ class DeviceSimulator:
         # Interno para riego por duración
         self._riego_until_ts = None
 
+    @classmethod
+    def crear_lote(cls, seriales, plantilla, parametros=None, **kwargs):
+        """
+        Crea un simulador por serial, todos de la misma plantilla, sin pasar por
+        __init__ para cada uno: se construye un prototipo, los valores iniciales
+        se muestrean por columnas y cada instancia copia el estado compartido.
+        'parametros' (opcional): lista de dicts ya conocidos, uno por serial (p.ej. snapshot).
+        """
+        seriales = list(seriales)
+        if not seriales:
+            return []
+        proto = cls(serial=seriales[0], parametros_rules=plantilla.reglas, plantilla=plantilla,
+                    _muestrear=False, **kwargs)
+        claves = [r.nombre for r in proto.reglas]
+        if parametros is None:
+            extras = [(k, v) for k, v in PARAMETROS_EXTRA if k not in proto.param_rules]
+            todas = claves + [k for k, _ in extras]
+            extra_vals = tuple(v for _, v in extras)
+            # flujo de la cohorte: mismo lote + misma semilla → mismos valores
+            cohorte = flujo("cohorte", plantilla.nombre_archivo, seriales[0], len(seriales))
+            columnas = _muestrear_iniciales(proto.reglas, len(seriales), cohorte)
+            filas = zip(*columnas) if columnas else repeat((), len(seriales))
+            parametros = (dict(zip(todas, fila + extra_vals)) for fila in filas)
+        parametros = iter(parametros)
+
+        # el prototipo es el primer dispositivo del lote
+        proto._params = next(parametros)
+        base = proto.__dict__
+        iny_base = dict.fromkeys(claves, False)
+
+        new = object.__new__
+        out = [proto]
+        append = out.append
+        for serial, params in zip(seriales[1:], parametros):
+            dd = base.copy()
+            dd["serial"] = serial
+            dd["_params"] = params
+            dd["_wlock"] = threading.Lock()
+            dd["_rng"] = None
+            dd["inyecciones"] = iny_base.copy()
+            d = new(cls)
+            d.__dict__ = dd
+            append(d)
+        return out
+
+    # ----------- Estado observable -----------
+    def _notificar(self, campo, valor):
+        obs = self._observador
+        if obs is not None:
+            obs(self, campo, valor)
+
+    @property
+    def apagado(self):
+        return self._apagado
+
+    @apagado.setter
+    def apagado(self, valor):
+        valor = bool(valor)
+        if valor != self._apagado:
+            self._apagado = valor
+            self._notificar("apagado", valor)
+
+    @property
+    def rng(self):
+        """random.Random propio del dispositivo: sin estado compartido entre hilos."""
+        r = self._rng
+        if r is None:
+            r = self._rng = flujo("dispositivo", self.serial)
+        return r
+
+    @property
+    def inyectado(self):
+        """True si algún parámetro tiene un valor inyectado fuera de rango."""
+        return any(self.inyecciones.values())
+
+    @property
+    def reclamado(self):
+        """True si ya se resolvió su ID en el backend."""
+        return self._device_id is not None
+
     # ----------- Simulación numérica aleatoria -----------
     def _step(self):
-        now = time.time()
-        # manejar riego por duración (si quedó programado)
-        if self._riego_until_ts is not None:
-            self.parametros["riego_en_curso"] = now < self._riego_until_ts
-            if not self.parametros["riego_en_curso"]:
-                self._riego_until_ts = None
-
-        for k, rule in self.param_rules.items():
-            if self.inyecciones.get(k, False):
-                continue
-
-            t = rule.get("tipo")
-            if t in ("float", "double"):
-                var = rule.get("variacion", (rule.get("max", 1) - rule.get("min", 0)) * 0.05)
-                cur = float(self.parametros.get(k, 0))
-                nuevo = clamp(cur + random.uniform(-var, var), rule.get("min", cur), rule.get("max", cur))
-                self.parametros[k] = round(nuevo, 3)
-            elif t == "int":
-                var = rule.get("variacion", 1)
-                cur = int(self.parametros.get(k, 0))
-                nuevo = int(clamp(cur + random.randint(-var, var), rule.get("min", cur), rule.get("max", cur)))
-                self.parametros[k] = nuevo
-            elif t == "boolean":
-                prob = rule.get("prob_flip", 0.01)
-                if random.random() < prob:
-                    self.parametros[k] = not bool(self.parametros.get(k, False))
-
-    def _estado_str(self):
+        with self._wlock:
+            params = dict(self._params)
+            now = time.time()
+            # manejar riego por duración (si quedó programado)
+            if self._riego_until_ts is not None:
+                params["riego_en_curso"] = now < self._riego_until_ts
+                if not params["riego_en_curso"]:
+                    self._riego_until_ts = None
+
+            iny = self.inyecciones
+            rng = self.rng
+            dt = self.interval
+            # las señales avanzan con el reloj simulado: tick a tick, reproducible con la semilla
+            t_sim = self._t_sim
+            t_sim = self._t_sim = reloj_inicio() if t_sim is None else t_sim + dt
+            for rule in self.reglas:
+                k = rule.nombre
+                if iny.get(k, False):
+                    continue
+
+                senal = rule.senal
+                if senal is not None:
+                    # modelo de señal de la plantilla (ver signals.py)
+                    params[k] = rule.acotar(senal.siguiente(params.get(k), params, t_sim, dt, rng))
+                elif rule.es_float:
+                    var = rule.variacion
+                    cur = float(params.get(k, 0))
+                    nuevo = clamp(cur + rng.uniform(-var, var), rule.min, rule.max)
+                    params[k] = round(nuevo, 3)
+                elif rule.es_int:
+                    var = rule.variacion
+                    cur = int(params.get(k, 0))
+                    params[k] = int(clamp(cur + rng.randint(-var, var), rule.min, rule.max))
+                elif rule.es_bool:
+                    if rng.random() < rule.prob_flip:
+                        params[k] = not bool(params.get(k, False))
+            self._params = params  # publica la instantánea del tick
+
+    @property
+    def parametros(self):
+        """Instantánea de solo lectura de los parámetros (sin locks)."""
+        return MappingProxyType(self._params)
+
+    @parametros.setter
+    def parametros(self, nuevos):
+        with self._wlock:
+            self._params = dict(nuevos)
+
+    def _actualizar(self, **cambios):
+        """Escritura copy-on-write: publica una instantánea nueva con 'cambios' aplicados."""
+        with self._wlock:
+            params = dict(self._params)
+            params.update(cambios)
+            self._params = params
+
+    def _estado_str(self, params=None):
         # Deriva "activo/inactivo" de parámetros según capability
         # - speed 0 => inactivo
         # - posicion 0 (y sin riego en curso) => inactivo
-        if "velocidad" in self.parametros and self.parametros["velocidad"] == 0:
+        params = self._params if params is None else params
+        if "velocidad" in params and params["velocidad"] == 0:
             return "inactivo"
-        if "posicion" in self.parametros and self.parametros["posicion"] == 0:
+        if "posicion" in params and params["posicion"] == 0:
             # si es persiana totalmente cerrada, toma inactivo
             return "inactivo"
-        if "riego_en_curso" in self.parametros and not self.parametros["riego_en_curso"]:
+        if "riego_en_curso" in params and not params["riego_en_curso"]:
             # si no está regando ahora, considera inactivo (para cards)
             # (puedes ajustar este criterio si prefieres "activo" while armed)
             return "inactivo"
@@ -246,40 +369,116 @@ class DeviceSimulator:
         return "inactivo" if self.apagado else "activo"
 
     def build_mqtt_payload(self):
-        return {
+        params = snap = self._params  # una sola lectura: estado y parámetros coherentes
+        fallas = self.fallas
+        if fallas:
+            # las campañas alteran solo la vista publicada, no el estado simulado
+            params = dict(params)
+            now = time.time()
+            for f in fallas:
+                f.aplicar(self, params, now)
+        payload = {
             "serial_number": self.serial,
-            "estado": self._estado_str(),
-            "parametros": self.parametros
+            "estado": self._estado_str(snap),
+            "parametros": params
         }
+        if self.trazar:
+            # seq monotónica por dispositivo y hora de envío en ns (ver trace_monitor.py)
+            self._seq += 1
+            payload["traza"] = {
+                "seq": self._seq,
+                "ts_ns": time.time_ns(),
+                "plantilla": self.plantilla.nombre_archivo if self.plantilla is not None else None,
+            }
+        return payload
 
     def publish_estado(self):
+        fallas = self.fallas
+        if fallas and any(f.suprime_publicacion() for f in fallas):
+            return  # campaña 'dropout': no se publica nada
         payload = self.build_mqtt_payload()
-        try:
-            publish.single(self.mqtt_topic, json.dumps(payload), hostname=self.mqtt_host)
-        except Exception as e:
-            print("[MQTT ERROR]", e)
-
-    def _run(self):
-        while self.running:
+        gw = self._gateway
+        if gw is not None:
+            gw.agregar(payload)  # el gateway publica el lote (ver gateways.py)
+            return
+        cola = self._cola
+        if cola is None or not (cola.conectado and self._cola_primaria):
+            cola = self._resolver_cola()
+        # no bloquea: si el broker no está, el mensaje queda en la cola/spool
+        if not PERFIL.activo:
+            cola.encolar(self.mqtt_topic, json.dumps(payload))
+            return
+        t0 = time.perf_counter()
+        msg = json.dumps(payload)
+        t1 = time.perf_counter()
+        cola.encolar(self.mqtt_topic, msg)
+        PERFIL.registrar("encode", t1 - t0)
+        PERFIL.registrar("publish", time.perf_counter() - t1)
+
+    def _resolver_cola(self):
+        """Broker por hash consistente del serial (con failover) si hay varios; si no, el configurado."""
+        r = enrutador()
+        if r.varios_brokers:
+            cola, self._cola_primaria = r.cola_para(self.serial)
+            self.mqtt_host, self.mqtt_port = cola.host, cola.port
+        else:
+            cola = obtener_cola(self.mqtt_host, self.mqtt_port, get_config())
+            self._cola_primaria = True
+        self._cola = cola
+        return cola
+
+    def reenrutar(self):
+        """Olvida la cola/broker resuelto (tras cambiar brokers en la config)."""
+        self._cola = None
+
+    def _run(self, stop):
+        # un error en un tick se informa y el hilo sigue (no queda "running" sin hilo)
+        while not stop.is_set():
             if not self.apagado:
-                self._step()
-                self.publish_estado()
-            else:
-                # Incluso apagado publica latido/estado
+                try:
+                    if PERFIL.activo:
+                        t0 = time.perf_counter()
+                        self._step()
+                        PERFIL.registrar("step", time.perf_counter() - t0)
+                    else:
+                        self._step()
+                except Exception as e:
+                    print(f"[SIM ERROR] {self.serial}: {e}")
+            # Incluso apagado publica latido/estado
+            try:
                 self.publish_estado()
-            time.sleep(self.interval)
+            except Exception as e:
+                print(f"[MQTT ERROR] {self.serial}: {e}")
+            stop.wait(self.interval)
 
     # ----------- Config remota (solo lectura HTTP GET) -----------
+    def _http(self, metodo, path, **kwargs):
+        """
+        Petición al backend del dispositivo: con varios backend_urls se elige por
+        hash consistente del serial (con failover); la sesión del endpoint reutiliza conexiones.
+        """
+        r = enrutador()
+        url = r.backend_para(self.serial) if r.varios_backends else self.backend_url
+        try:
+            resp = r.sesion(url).request(metodo, f"{url}{path}", **kwargs)
+        except Exception:  # requests.RequestException y afines (requests se importa en sharding)
+            r.marcar_caido(url)
+            raise
+        if resp.status_code >= 500:
+            r.marcar_caido(url)
+        return resp
+
     def _ensure_device_id(self):
         if not self.backend_url or self._device_id is not None:
             return
         try:
-            r = requests.get(f"{self.backend_url}/dispositivos", timeout=5)
+            r = self._http("GET", "/dispositivos", timeout=5)
             if r.status_code == 200:
                 lista = r.json()
                 match = next((d for d in lista if d.get("serial_number") == self.serial), None)
                 if match:
                     self._device_id = match["id"]
+                    self._notificar("reclamado", True)
         except Exception as e:
             print(f"[CFG] Error buscando ID para {self.serial}: {e}")
 
@@ -297,8 +496,9 @@ class DeviceSimulator:
             payload["estado"] = "activo" if encendido_actual else "inactivo"
 
         try:
-            resp = requests.put(
-                f"{self.backend_url}/dispositivos/{self._device_id}",
+            resp = self._http(
+                "PUT",
+                f"/dispositivos/{self._device_id}",
                 json=payload,
                 timeout=5
             )
@@ -365,7 +565,7 @@ class DeviceSimulator:
         now = _now(); t = now.time(); today = _today_key_en(now)
         sched = cfg.get("horarios_pos") or {}
         todays = list(sched.get(today, [])) + list(sched.get("diario", []))
-        pos = self.parametros.get("posicion", 0)
+        pos = self._params.get("posicion", 0)
         events = []
         for hhmm, val in todays:
             try:
@@ -378,14 +578,14 @@ class DeviceSimulator:
         for tm, vv in events:
             if tm <= t:
                 pos = vv
-        self.parametros["posicion"] = pos
+        self._actualizar(posicion=pos)
         # si posición 0, marcamos apagado? preferimos NO tocar self.apagado aquí
 
     def _apply_speed_schedule(self, cfg):
         now = _now(); t = now.time(); today = _today_key_en(now)
         sched = cfg.get("horarios_speed") or {}
         todays = list(sched.get(today, [])) + list(sched.get("diario", []))
-        spd = self.parametros.get("velocidad", 0)
+        spd = self._params.get("velocidad", 0)
         events = []
         for hhmm, val in todays:
             try:
@@ -398,13 +598,13 @@ class DeviceSimulator:
         for tm, vv in events:
             if tm <= t:
                 spd = vv
-        self.parametros["velocidad"] = spd
+        self._actualizar(velocidad=spd)
 
     def _apply_lock_schedule(self, cfg):
         now = _now(); t = now.time(); today = _today_key_en(now)
         sched = cfg.get("horarios_lock") or {}
         todays = list(sched.get(today, [])) + list(sched.get("diario", []))
-        lock_state = self.parametros.get("lock_state", "unlock")
+        lock_state = self._params.get("lock_state", "unlock")
         events = []
         for hhmm, action in todays:
             try:
@@ -418,7 +618,7 @@ class DeviceSimulator:
         for tm, act in events:
             if tm <= t:
                 lock_state = act
-        self.parametros["lock_state"] = lock_state
+        self._actualizar(lock_state=lock_state)
 
     def _apply_riego_schedule(self, cfg):
         """
@@ -432,9 +632,9 @@ class DeviceSimulator:
 
         # Mantener en curso si ya había uno
         if self._riego_until_ts is not None and time.time() < self._riego_until_ts:
-            self.parametros["riego_en_curso"] = True
+            en_curso = True
         else:
-            self.parametros["riego_en_curso"] = False
+            en_curso = False
             self._riego_until_ts = None
 
         events = []
@@ -453,13 +653,14 @@ class DeviceSimulator:
                 start_dt = now_dt.replace(hour=tm.hour, minute=tm.minute, second=0, microsecond=0)
                 until = start_dt + datetime.timedelta(minutes=dur)
                 self._riego_until_ts = until.timestamp()
-                self.parametros["riego_en_curso"] = time.time() < self._riego_until_ts
+                en_curso = time.time() < self._riego_until_ts
+        self._actualizar(riego_en_curso=en_curso)
 
     def _apply_temp_schedule(self, cfg):
         now = _now(); t = now.time(); today = _today_key_en(now)
         sched = cfg.get("horarios_temp") or {}
         todays = list(sched.get(today, [])) + list(sched.get("diario", []))
-        sp = self.parametros.get("setpoint_c", None)
+        sp = self._params.get("setpoint_c", None)
         events = []
         for hhmm, val in todays:
             try:
@@ -472,13 +673,13 @@ class DeviceSimulator:
         for tm, vv in events:
             if tm <= t:
                 sp = vv
-        self.parametros["setpoint_c"] = sp
+        self._actualizar(setpoint_c=sp)
 
     # ----------- Aplicación general de configuración -----------
     def _aplicar_config(self, cfg):
-        kind = _guess_kind(self.serial, cfg)
-        capability = cfg.get("capability") or _capability_for_kind(kind)
-        canal = _channel_for_kind(kind)
+        kind = guess_kind(self.serial, cfg, self.kind)
+        capability = cfg.get("capability") or capability_for_kind(kind)
+        canal = channel_for_kind(kind)
 
         modo = str(cfg.get("modo") or "").lower()
         if not modo:
@@ -524,52 +725,177 @@ class DeviceSimulator:
         if isinstance(intervalo, (int, float)) and intervalo > 0:
             self.interval = int(intervalo)
 
-    def _poll_remote_config(self):
-        while self.running and self.backend_url:
-            try:
-                self._ensure_device_id()
-                if self._device_id is not None:
-                    r = requests.get(f"{self.backend_url}/dispositivos/{self._device_id}", timeout=5)
-                    if r.status_code == 200:
-                        data = r.json()
-                        cfg = data.get("configuracion") or {}
-                        self._aplicar_config(cfg)
-            except Exception as e:
-                print(f"[CFG] Error leyendo configuración remota: {e}")
-            time.sleep(self.poll_config_interval)
+    def recibir_config(self, data):
+        """
+        Config empujada por MQTT (modo config_push). Acepta el dispositivo completo
+        ({"configuracion": {...}}) o solo el bloque de configuración.
+        """
+        if not isinstance(data, dict):
+            return
+        cfg = data.get("configuracion", data)
+        if not isinstance(cfg, dict):
+            return
+        if not self.backend_url:
+            # sin backend no hay HTTP en _aplicar_config: se aplica en el acto
+            self._aplicar_config_medido(dict(cfg))
+            return
+        # con backend, aplicarla puede hacer un PUT: la aplica el hilo cfg del dispositivo
+        # (si no está corriendo, al arrancar)
+        self._cfg_pendiente = dict(cfg)
+        evt = self._cfg_evt
+        if evt is not None:
+            evt.set()
+
+    def _aplicar_config_medido(self, cfg):
+        if not PERFIL.activo:
+            return self._aplicar_config(cfg)
+        t0 = time.perf_counter()
+        self._aplicar_config(cfg)
+        PERFIL.registrar("schedule", time.perf_counter() - t0)
+
+    def _poll_remote_config(self, stop, cfg_evt):
+        proximo = time.monotonic()
+        while not stop.is_set() and self.backend_url:
+            cfg_evt.clear()
+            cfg, self._cfg_pendiente = self._cfg_pendiente, None
+            if cfg is not None:
+                try:
+                    self._aplicar_config_medido(cfg)
+                except Exception as e:
+                    print(f"[CFG] Error aplicando config MQTT en {self.serial}: {e}")
+            if time.monotonic() >= proximo:
+                try:
+                    self._ensure_device_id()
+                    if self._device_id is not None:
+                        t0 = time.perf_counter() if PERFIL.activo else None
+                        r = self._http("GET", f"/dispositivos/{self._device_id}", timeout=5)
+                        if t0 is not None:
+                            PERFIL.registrar("poll", time.perf_counter() - t0)
+                        if r.status_code == 200:
+                            data = r.json()
+                            cfg = data.get("configuracion") or {}
+                            self._aplicar_config_medido(cfg)
+                except Exception as e:
+                    print(f"[CFG] Error leyendo configuración remota: {e}")
+                proximo = time.monotonic() + self.poll_config_interval
+            # duerme hasta el próximo poll o hasta que llegue config por MQTT / se detenga
+            cfg_evt.wait(max(0.0, proximo - time.monotonic()))
 
     # ----------- API pública -----------
     def start(self):
         if self.running:
             return
         self.running = True
-        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._notificar("running", True)
+        stop = self._stop_evt = threading.Event()
+        cfg_evt = self._cfg_evt = threading.Event()
+        # nombres "rol:serial": el perfilador agrupa las pilas por rol
+        self._thread = threading.Thread(target=self._run, args=(stop,), name=f"sim:{self.serial}", daemon=True)
         self._thread.start()
         if self.backend_url:
-            self._cfg_thread = threading.Thread(target=self._poll_remote_config, daemon=True)
+            self._cfg_thread = threading.Thread(target=self._poll_remote_config, args=(stop, cfg_evt),
+                                                name=f"cfg:{self.serial}", daemon=True)
             self._cfg_thread.start()
 
-    def stop(self):
-        self.running = False
-        if self._thread:
-            self._thread.join(timeout=1)
+    def solicitar_parada(self):
+        """Marca el dispositivo como detenido y despierta sus hilos (no espera)."""
+        if self.running:
+            self.running = False
+            self._notificar("running", False)
+        if self._stop_evt is not None:
+            self._stop_evt.set()
+        if self._cfg_evt is not None:
+            self._cfg_evt.set()
+
+    def esperar_parada(self, deadline):
+        """
+        Espera a los hilos hasta 'deadline' (time.monotonic()).
+        Devuelve True si ambos terminaron.
+        """
+        for th in (self._thread, self._cfg_thread):
+            if th is not None and th is not threading.current_thread():
+                th.join(timeout=max(0.0, deadline - time.monotonic()))
+        ok = not any(th is not None and th.is_alive() for th in (self._thread, self._cfg_thread))
+        if ok:
+            self._thread = self._cfg_thread = None
+        return ok
+
+    def stop(self, timeout=1):
+        self.solicitar_parada()
+        return self.esperar_parada(time.monotonic() + timeout)
+
+    def aplicar_ajustes(self, interval=None, mqtt_host=None, mqtt_port=None, mqtt_topic=None,
+                        backend_url=None, poll_config_interval=None, reglas=None, plantilla=None,
+                        trazar=None):
+        """
+        Aplica en caliente ajustes recargados (config.json / plantilla) sin detener el hilo.
+        Cada atributo se reemplaza por referencia (asignación atómica); las reglas se
+        sustituyen como una tupla nueva, así _step ve la versión vieja o la nueva completa.
+        """
+        if reglas is not None:
+            reglas = compilar_reglas(reglas)
+            with self._wlock:
+                params = dict(self._params)
+                for rule in reglas:
+                    if rule.nombre not in params:
+                        if rule.es_float or rule.es_int:
+                            params[rule.nombre] = rule.min
+                        elif rule.es_bool:
+                            params[rule.nombre] = False
+                        else:
+                            params[rule.nombre] = rule.default
+                    self.inyecciones.setdefault(rule.nombre, False)
+                self._params = params
+            self.param_rules = {r.nombre: r for r in reglas}
+            self.reglas = reglas
+        if plantilla is not None:
+            self.plantilla = plantilla
+            self.kind = plantilla.kind
+        if interval is not None:
+            self.interval = max(1, int(interval))
+        if mqtt_host:
+            self.mqtt_host = mqtt_host
+            self._cola = None
+        if mqtt_port:
+            self.mqtt_port = int(mqtt_port)
+            self._cola = None
+        if mqtt_topic:
+            self.mqtt_topic = mqtt_topic
+        if backend_url:
+            self.backend_url = backend_url
+        if poll_config_interval:
+            self.poll_config_interval = max(1, int(poll_config_interval))
+        if trazar is not None:
+            self.trazar = bool(trazar)
 
     def set_parametro(self, key, value):
-        if key in self.parametros:
-            mn = self.param_rules.get(key, {}).get("min", float("-inf"))
-            mx = self.param_rules.get(key, {}).get("max", float("inf"))
+        with self._wlock:
+            if key not in self._params:
+                return False
+            rule = self.param_rules.get(key)
+            numerica = rule is not None and (rule.es_float or rule.es_int)
+            mn = rule.min if numerica else float("-inf")
+            mx = rule.max if numerica else float("inf")
+            antes = self.inyectado
             if isinstance(value, (int, float)) and (value < mn or value > mx):
                 self.inyecciones[key] = True
             else:
                 self.inyecciones[key] = False
-            self.parametros[key] = value
-            return True
-        return False
+            params = dict(self._params)
+            params[key] = value
+            self._params = params
+            despues = self.inyectado
+        if despues != antes:
+            self._notificar("inyectado", despues)
+        return True
 
     def set_parametros_bulk(self, new_params: dict):
-        for k, v in new_params.items():
-            if k in self.parametros:
-                self.parametros[k] = v
+        with self._wlock:
+            params = dict(self._params)
+            for k, v in new_params.items():
+                if k in params:
+                    params[k] = v
+            self._params = params
 
     def apagar(self):
         self.apagado = True
@@ -0,0 +1,245 @@
+# gateways.py
+"""
+Modo gateway: muchas lecturas por mensaje MQTT.
+
+Con "gateway_mode": true el manager agrupa los dispositivos en gateways
+virtuales de 'gateway_devices' dispositivos (en orden de alta). Cada
+dispositivo sigue armando su payload (build_mqtt_payload: fallas, traza, ...),
+pero en vez de publicarlo se lo entrega a su gateway, que lo acumula y publica
+un único mensaje cuando el lote llega a 'gateway_batch_max' lecturas o cuando
+pasan 'gateway_window_ms' desde la primera lectura del lote:
+
+  topic: mqtt_topic_gateway ("{gateway}" se reemplaza por el id)
+  {"gateway_id": "gw-0001", "seq": n, "ts_ns": hora de envío en ns,
+   "n": lecturas, "lecturas": [payload, payload, ...]}
+
+'seq' es monotónica por gateway (los lotes se encolan en orden). El broker de
+cada gateway se elige por hash consistente de su id (ver sharding.py).
+MotorGateways.tasas() compara mensajes/s contra lecturas/s.
+"""
+import json
+import threading
+import time
+from mqtt_queue import obtener_cola
+from sharding import enrutador
+from config_loader import get_config
+
+CLAVES_GATEWAY = ("gateway_mode", "gateway_devices", "gateway_batch_max",
+                  "gateway_window_ms", "mqtt_topic_gateway")
+
+class Gateway:
+    def __init__(self, gid, topic, max_lecturas, ventana_s):
+        self.id = gid
+        self.miembros = set()  # seriales
+        self.ajustar(topic, max_lecturas, ventana_s)
+        self._lock = threading.Lock()
+        self._buf = []
+        self._abierto = None   # time.monotonic() de la primera lectura del lote
+        self._seq = 0
+        self._cola = None
+        self._cola_primaria = True
+        # Contadores (solo crecen; MotorGateways.tasas() calcula diferencias)
+        self.mensajes = 0
+        self.lecturas = 0
+        self.bytes = 0
+
+    def ajustar(self, topic, max_lecturas, ventana_s):
+        self.topic = topic.replace("{gateway}", self.id)
+        self.max_lecturas = max(1, int(max_lecturas))
+        self.ventana_s = max(0.001, float(ventana_s))
+
+    def agregar(self, payload):
+        """Llamado desde el hilo del dispositivo: acumula y publica si el lote se llenó."""
+        with self._lock:
+            if not self._buf:
+                self._abierto = time.monotonic()
+            self._buf.append(payload)
+            if len(self._buf) >= self.max_lecturas:
+                self._publicar()
+
+    def vaciar_si_vence(self, now):
+        """Publica si venció la ventana. Devuelve segundos hasta el próximo vencimiento (None = vacío)."""
+        with self._lock:
+            if not self._buf:
+                return None
+            resta = self._abierto + self.ventana_s - now
+            if resta > 0:
+                return resta
+            self._publicar()
+        return None
+
+    def vaciar(self):
+        with self._lock:
+            if self._buf:
+                self._publicar()
+
+    def _publicar(self):
+        # requiere _lock: seq y encolado en el mismo orden
+        lote, self._buf = self._buf, []
+        self._seq += 1
+        msg = json.dumps({
+            "gateway_id": self.id,
+            "seq": self._seq,
+            "ts_ns": time.time_ns(),
+            "n": len(lote),
+            "lecturas": lote,
+        })
+        cola = self._cola
+        if cola is None or not (cola.conectado and self._cola_primaria):
+            cola = self._resolver_cola()
+        cola.encolar(self.topic, msg)
+        self.mensajes += 1
+        self.lecturas += len(lote)
+        self.bytes += len(msg)
+
+    def _resolver_cola(self):
+        r = enrutador()
+        if r.varios_brokers:
+            cola, self._cola_primaria = r.cola_para(self.id)
+        else:
+            host, port = r.brokers[0]
+            cola, self._cola_primaria = obtener_cola(host, port, get_config()), True
+        self._cola = cola
+        return cola
+
+    def reenrutar(self):
+        self._cola = None
+
+class MotorGateways:
+    """
+    Asigna dispositivos a gateways y vence las ventanas de tiempo. Un único
+    hilo duerme hasta el próximo vencimiento; el corte por tamaño ocurre en el
+    hilo del dispositivo que completa el lote.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.gateways = {}   # id -> Gateway
+        self.activo = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._abierto = None  # gateway que recibe las próximas altas
+        self._n = 0
+        self.tam = None
+        self._marca = (time.monotonic(), 0, 0, 0)  # (t, mensajes, lecturas, bytes) de la última medición
+        self.configurar(manager.config)
+
+    # ----------- Configuración / asignación -----------
+    def configurar(self, config):
+        """Aplica las claves gateway_* (al iniciar y tras recargar config.json)."""
+        activo = bool(config.get("gateway_mode", False))
+        tam = max(1, int(config.get("gateway_devices", 100)))
+        self._topic = config.get("mqtt_topic_gateway", "gateways/{gateway}/estado")
+        self._max = config.get("gateway_batch_max", 100)
+        self._ventana_s = config.get("gateway_window_ms", 1000) / 1000.0
+        reasignar = activo != self.activo or (activo and tam != self.tam)
+        self.tam = tam
+        with self._lock:
+            for gw in self.gateways.values():
+                gw.ajustar(self._topic, self._max, self._ventana_s)
+        if reasignar:
+            self._desarmar()
+            self.activo = activo
+            if activo:
+                self.asignar(sorted(self.manager.devices.values(), key=lambda d: d.serial))
+                self._asegurar_hilo()
+                print(f"📦 Modo gateway activo: {len(self.gateways)} gateways de hasta {tam} dispositivos "
+                      f"(lote {self._max} lecturas / {self._ventana_s * 1000:.0f} ms)")
+        self._wake.set()
+
+    def asignar(self, devices):
+        """Reparte dispositivos nuevos llenando el último gateway abierto."""
+        if not self.activo:
+            return
+        with self._lock:
+            for d in devices:
+                gw = self._abierto
+                if gw is None or len(gw.miembros) >= self.tam:
+                    self._n += 1
+                    gw = self._abierto = Gateway(f"gw-{self._n:04d}", self._topic, self._max, self._ventana_s)
+                    self.gateways[gw.id] = gw
+                gw.miembros.add(d.serial)
+                d._gateway = gw
+
+    def liberar(self, d):
+        gw = d._gateway
+        d._gateway = None
+        if gw is not None:
+            with self._lock:
+                gw.miembros.discard(d.serial)
+
+    def _desarmar(self):
+        """Devuelve los dispositivos a la publicación directa y vacía los lotes pendientes."""
+        with self._lock:
+            gateways = list(self.gateways.values())
+            self.gateways = {}
+            self._abierto = None
+            self._n = 0
+        for d in list(self.manager.devices.values()):
+            d._gateway = None
+        for gw in gateways:
+            gw.vaciar()
+
+    def reenrutar(self):
+        for gw in list(self.gateways.values()):
+            gw.reenrutar()
+
+    def vaciar(self):
+        """Publica todos los lotes pendientes (p.ej. al detener la flota)."""
+        for gw in list(self.gateways.values()):
+            gw.vaciar()
+
+    # ----------- Ventanas de tiempo -----------
+    def _asegurar_hilo(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="gateways", daemon=True)
+            self._thread.start()
+
+    def procesar(self, now=None):
+        """Publica los lotes vencidos. Devuelve segundos hasta el próximo vencimiento."""
+        now = now if now is not None else time.monotonic()
+        proximo = None
+        for gw in list(self.gateways.values()):
+            resta = gw.vaciar_si_vence(now)
+            if resta is not None:
+                proximo = resta if proximo is None else min(proximo, resta)
+        return proximo
+
+    def _loop(self):
+        while True:
+            self._wake.clear()
+            espera = self.procesar() if self.activo else None
+            self._wake.wait(espera if espera is not None else self._ventana_s)
+
+    # ----------- Tasas -----------
+    def totales(self):
+        gws = list(self.gateways.values())
+        return (sum(g.mensajes for g in gws), sum(g.lecturas for g in gws), sum(g.bytes for g in gws))
+
+    def tasas(self):
+        """Mensajes/s, lecturas/s y bytes/s desde la medición anterior."""
+        t = time.monotonic()
+        mensajes, lecturas, nbytes = self.totales()
+        t0, m0, l0, b0 = self._marca
+        self._marca = (t, mensajes, lecturas, nbytes)
+        dt = max(1e-9, t - t0)
+        dm, dl = max(0, mensajes - m0), max(0, lecturas - l0)
+        return {
+            "segundos": dt,
+            "mensajes_s": dm / dt,
+            "lecturas_s": dl / dt,
+            "bytes_s": max(0, nbytes - b0) / dt,
+            "lecturas_por_mensaje": dl / dm if dm else 0.0,
+        }
+
+    def resumen(self):
+        if not self.activo:
+            return "📦 Modo gateway inactivo (\"gateway_mode\": false)"
+        t = self.tasas()
+        mensajes, lecturas, _ = self.totales()
+        pendientes = sum(len(g._buf) for g in list(self.gateways.values()))
+        return (f"📦 {len(self.gateways)} gateways | últimos {t['segundos']:.1f}s: "
+                f"{t['mensajes_s']:.1f} mensajes/s vs {t['lecturas_s']:.1f} lecturas/s "
+                f"({t['lecturas_por_mensaje']:.1f} lecturas/mensaje, {t['bytes_s'] / 1024:.1f} KiB/s) | "
+                f"total {mensajes} mensajes, {lecturas} lecturas, {pendientes} en lotes abiertos")
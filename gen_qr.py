@@ -1,37 +1,32 @@
 # gen_qr.py
-import qrcode
 import json
-import webbrowser
 import os
+import io
+import base64
+import hashlib
+import html
 import tempfile
 import threading
 import time
+# qrcode (y PIL), webbrowser, zipfile y el pool de procesos se importan al
+# usarse: el CLI arranca sin pagar por ellos si nunca se genera un QR.
 
 def generar_qr_reclamo(serial, templates_dict):
     def worker():
-        prefix = serial[:4]  # usamos sufijo de 4 caracteres
-        template = next(
-            (tpl for tpl in templates_dict.values() if tpl.get("serial_prefix") == prefix),
-            None
-        )
+        # búsqueda O(1) por serial_prefix en el índice de plantillas
+        template = templates_dict.para_serial(serial)
 
         if not template:
-            print(f"No se encontró template para prefijo {prefix}")
+            print(f"No se encontró template para prefijo {serial[:4]}")
             return
 
         # Datos mínimos para el reclamo
-        data = {
-            "serial_number": serial,
-            "nombre": template.get("nombre", ""),
-            "tipo": template.get("tipo", ""),
-            "modelo": template.get("modelo", ""),
-            "descripcion": template.get("descripcion", ""),
-            "configuracion": template.get("configuracion", {})
-        }
+        data = {"serial_number": serial, **template.payload_reclamo()}
 
         # Crear QR en archivo temporal
         tmpdir = tempfile.gettempdir()
         img_path = os.path.join(tmpdir, f"qr_{serial}.png")
+        import qrcode
         qr = qrcode.make(json.dumps(data, ensure_ascii=False))
         qr.save(img_path)
 
@@ -60,6 +55,7 @@ def generar_qr_reclamo(serial, templates_dict):
             """)
 
         print(f"✅ QR generado en: {html_path}")
+        import webbrowser
         webbrowser.open_new_tab(f"file://{html_path}")
 
         # Proceso de cleanup automático después de un rato
@@ -77,3 +73,105 @@ def generar_qr_reclamo(serial, templates_dict):
 
     # Lanzamos en un hilo aparte para no bloquear
     threading.Thread(target=worker, daemon=True).start()
+
+# ---------------- Exportación en lote (sin navegador) ----------------
+# Caché del proceso principal: sha1(payload) -> PNG. Payloads idénticos se renderizan una vez.
+_PNG_CACHE = {}
+LOTE_MIN_PARALELO = 64  # por debajo, el arranque del pool cuesta más que renderizar en serie
+
+def _render_png(payload):
+    """Worker (proceso hijo): payload JSON → bytes PNG del QR."""
+    buf = io.BytesIO()
+    import qrcode
+    qrcode.make(payload).save(buf, format="PNG")
+    return buf.getvalue()
+
+def _hoja_html(seriales, src):
+    celdas = "\n".join(
+        f'<div class="et"><img src="{src(s)}"/><div>{html.escape(s)}</div></div>' for s in seriales
+    )
+    return f"""<html>
+<head>
+    <meta charset="utf-8"/>
+    <title>Etiquetas QR ({len(seriales)})</title>
+    <style>
+        body {{ font-family: Arial; margin: 10mm; }}
+        .et {{ display: inline-block; width: 45mm; margin: 2mm; text-align: center;
+               font-size: 9pt; page-break-inside: avoid; }}
+        .et img {{ width: 40mm; height: 40mm; }}
+    </style>
+</head>
+<body>
+{celdas}
+</body>
+</html>
+"""
+
+def exportar_qr_lote(seriales, templates_dict, destino=None, procesos=None, formato="zip"):
+    """
+    Genera los QR de reclamo de muchos seriales en paralelo (ProcessPoolExecutor),
+    sin abrir navegador. Escribe un único archivo:
+      - formato="zip"  → PNG por serial + etiquetas.html (hoja imprimible)
+      - formato="html" → hoja imprimible con las imágenes embebidas (base64)
+    Devuelve la ruta del archivo generado (o None si no hubo nada que exportar).
+    """
+    if formato not in ("zip", "html"):
+        raise ValueError(f"formato no soportado: {formato}")
+    t0 = time.perf_counter()
+    seriales = list(dict.fromkeys(seriales))  # sin duplicados, conserva orden
+    payloads = {}
+    bases = {}  # plantilla -> payload_reclamo() (se calcula una vez por plantilla)
+    for s in seriales:
+        template = templates_dict.para_serial(s)
+        if not template:
+            print(f"⚠️ Sin template para {s}, se omite")
+            continue
+        if template not in bases:
+            bases[template] = template.payload_reclamo()
+        payloads[s] = json.dumps({"serial_number": s, **bases[template]}, ensure_ascii=False)
+    if not payloads:
+        print("No hay seriales válidos para exportar.")
+        return None
+
+    claves = {s: hashlib.sha1(p.encode("utf-8")).hexdigest() for s, p in payloads.items()}
+    pendientes = {}
+    for s, k in claves.items():
+        if k not in _PNG_CACHE:
+            pendientes.setdefault(k, payloads[s])
+    hits = len(claves) - len(pendientes)
+
+    t1 = time.perf_counter()
+    if pendientes:
+        claves_p = list(pendientes)
+        textos = list(pendientes.values())
+        if len(textos) < LOTE_MIN_PARALELO or procesos == 1:
+            pngs = list(map(_render_png, textos))
+        else:
+            procesos = procesos or os.cpu_count() or 1
+            chunk = max(1, len(textos) // (procesos * 8))
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=procesos) as pool:
+                pngs = list(pool.map(_render_png, textos, chunksize=chunk))
+        _PNG_CACHE.update(zip(claves_p, pngs))
+    t2 = time.perf_counter()
+
+    validos = list(payloads)
+    if destino is None:
+        destino = os.path.join(tempfile.gettempdir(), f"qr_lote_{int(time.time())}.{formato}")
+    if formato == "html":
+        def src(s):
+            return "data:image/png;base64," + base64.b64encode(_PNG_CACHE[claves[s]]).decode("ascii")
+        with open(destino, "w", encoding="utf-8") as f:
+            f.write(_hoja_html(validos, src))
+    else:
+        import zipfile
+        with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_STORED) as zf:
+            for s in validos:
+                zf.writestr(f"qr_{s}.png", _PNG_CACHE[claves[s]])
+            zf.writestr("etiquetas.html", _hoja_html(validos, lambda s: f"qr_{s}.png"))
+    t3 = time.perf_counter()
+
+    print(f"✅ {len(validos)} QR exportados en: {destino}")
+    print(f"⏱️ preparar {t1 - t0:.3f}s | render {t2 - t1:.3f}s "
+          f"({len(pendientes)} nuevos, {hits} en caché) | escribir {t3 - t2:.3f}s | total {t3 - t0:.3f}s")
+    return destino
@@ -1,5 +1,76 @@
 # main.py
-from cli import iniciar_cli
+import argparse
+import sys
+import time
+
+def ejecutar_headless(args):
+    """Corre una flota sin menú durante 'duracion' segundos (para pruebas de carga / perfilado)."""
+    from config_loader import REGISTRO
+    from manager import DevicesManager
+    from mqtt_queue import cerrar_colas
+    from profiler import PERFIL
+    import semillas
+
+    plantillas = REGISTRO.plantillas()
+    nombre = args.plantilla[:-5] if args.plantilla.endswith(".json") else args.plantilla
+    tpl = plantillas.get(nombre)
+    if tpl is None:
+        print(f"❌ Plantilla no encontrada: {args.plantilla} (disponibles: {', '.join(plantillas) or '-'})")
+        return 1
+
+    if args.semilla is not None:
+        semillas.fijar_semilla(args.semilla)
+    manager = DevicesManager()
+    # igual que el CLI: el hilo de vigilancia recarga config/plantillas y notifica al manager
+    REGISTRO.iniciar_vigilancia()
+    if args.gateway is not None:
+        config = dict(REGISTRO.config(), gateway_mode=True)
+        if args.gateway:
+            config["gateway_devices"] = args.gateway
+        manager.gateways.configurar(config)
+    t0 = time.perf_counter()
+    manager.create_from_template(tpl, count=args.cantidad)
+    print(f"{args.cantidad} dispositivos creados en {time.perf_counter() - t0:.3f}s")
+
+    if args.perfil:
+        PERFIL.iniciar(REGISTRO.get("profile_interval_ms", 10) / 1000.0)
+    manager.start_all()
+    try:
+        time.sleep(args.duracion)
+    except KeyboardInterrupt:
+        print("Interrumpido.")
+    finally:
+        REGISTRO.detener_vigilancia()
+        manager.stop_all(timeout=REGISTRO.get("shutdown_timeout", 5))
+        if manager.gateways.activo:
+            print(manager.gateways.resumen())
+        if PERFIL.activo:
+            PERFIL.detener(args.perfil)
+        cerrar_colas()
+        print(f"🎲 Semilla: {semillas.semilla()} (--semilla para repetir la corrida)")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="IoT Alchemy")
+    parser.add_argument("--headless", action="store_true", help="correr sin menú interactivo")
+    parser.add_argument("--plantilla", help="nombre de plantilla (p.ej. sensor_temp)")
+    parser.add_argument("--cantidad", type=int, default=100)
+    parser.add_argument("--duracion", type=float, default=60, help="segundos de simulación")
+    parser.add_argument("--semilla", help="semilla de la corrida (repite la simulación bit a bit)")
+    parser.add_argument("--perfil", nargs="?", const="perfil.folded", default=None,
+                        help="activar perfilado y volcar pilas colapsadas en este archivo")
+    parser.add_argument("--gateway", nargs="?", type=int, const=0, default=None, metavar="N",
+                        help="modo gateway: lotes de lecturas por mensaje (N dispositivos por gateway)")
+    args = parser.parse_args(argv)
+
+    if args.headless:
+        if not args.plantilla:
+            parser.error("--headless requiere --plantilla")
+        return ejecutar_headless(args)
+
+    from cli import iniciar_cli
+    iniciar_cli()
+    return 0
 
 if __name__ == "__main__":
-    iniciar_cli()
\ No newline at end of file
+    sys.exit(main())
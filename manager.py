@@ -1,53 +1,360 @@
-import os
+import gc
 import json
+import queue
+import threading
+import time
+import snapshot
+import semillas
+from campaigns import MotorCampanas
+from gateways import CLAVES_GATEWAY, MotorGateways
+from mqtt_queue import CLAVES_COLA, obtener_cola, reconfigurar_colas
+from sharding import CLAVES_ENRUTADOR, enrutador, reconfigurar
 from device import DeviceSimulator
-from utils import generar_serial
+from utils import generar_seriales
+from config_loader import REGISTRO
 
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
-
-def load_config():
-    try:
-        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"⚠️ No se pudo cargar config.json: {e}")
-        return {}
-    
+# Índices de estado: campo observable del dispositivo -> nombre del set
+_INDICES_ESTADO = ("running", "apagado", "inyectado", "reclamado")
 
 class DevicesManager:
-    def __init__(self):
+    def __init__(self, registro=REGISTRO):
         self.devices = {}  # serial -> DeviceSimulator
-        self.config = load_config()
+        self.registro = registro
+        # Semilla de la corrida (config "seed"; si no hay, una aleatoria que se informa)
+        semillas.fijar_inicio(self.config.get("sim_start"))
+        semillas.iniciar(self.config.get("seed"))
+        # Índices secundarios (seriales), mantenidos en alta/baja y por los
+        # avisos de cambio de estado de cada dispositivo (ver DeviceSimulator._notificar)
+        self._idx_lock = threading.Lock()
+        self._por_plantilla = {}  # nombre de plantilla ("" = sin plantilla) -> set
+        self._idx = {campo: set() for campo in _INDICES_ESTADO}
+        # Campañas de inyección de fallas sobre cohortes de la flota
+        self.campanas = MotorCampanas(self)
+        # Modo gateway: lecturas de muchos dispositivos por mensaje MQTT (config "gateway_mode")
+        self.gateways = MotorGateways(self)
+        # Config empujada por MQTT (config_push): topic suscrito y cola de aplicación
+        self._push_sub = None
+        self._push_colas = []
+        self._push_q = queue.Queue()
+        self._push_thread = None
+        self._configurar_push()
+        # Recarga en caliente: cambios en config.json / plantillas se empujan a los dispositivos
+        self.registro.suscribir(self._on_recarga)
+
+    @property
+    def config(self):
+        return self.registro.config()
 
     def create_from_template(self, template, count=1, serial_custom=None):
         """
-        Crea uno o varios dispositivos desde una plantilla.
-        - Si serial_custom viene, solo crea 1 con ese serial exacto.
-        - Si no, genera 'count' dispositivos con serial aleatorio.
+        Crea uno o varios dispositivos desde una plantilla (compilada, ver templates_loader.Plantilla).
+        - Si serial_custom viene, solo crea 1 con ese serial exacto (si no está en uso).
+        - Si no, genera 'count' dispositivos con seriales aleatorios únicos, en bloque.
         """
-        created = []
         if serial_custom:
+            if serial_custom in self.devices:
+                print(f"⚠️ Ya existe un dispositivo con serial {serial_custom}")
+                return []
             seriales = [serial_custom]
         else:
-            seriales = [generar_serial(template.get("serial_prefix", "DEV")) for _ in range(count)]
-
-        for serial in seriales:
-            params_rules = template.get("parametros", {}) or {}
-            interval = int(template.get("configuracion", {}).get("intervalo_envio", 5))
-
-            d = DeviceSimulator(
-                serial=serial,
-                parametros_rules=params_rules,
-                mqtt_topic=self.config.get("mqtt_topic_estado", "dispositivos/estado"),
-                interval=interval,
-                mqtt_host=self.config.get("mqtt_host", "localhost"),
-                backend_url=self.config.get("backend_url"),
-                poll_config_interval=self.config.get("poll_config_interval", 3)
+            seriales = None
+
+        config = self.config
+        # Alta masiva: el GC cíclico se pausa mientras se crean miles de objetos nuevos
+        gc_activo = gc.isenabled()
+        gc.disable()
+        try:
+            if seriales is None:
+                seriales = generar_seriales(template.serial_prefix, count, existentes=self.devices)
+            created = DeviceSimulator.crear_lote(
+                seriales,
+                template,
+                mqtt_topic=config.get("mqtt_topic_estado", "dispositivos/estado"),
+                interval=template.intervalo,
+                mqtt_host=config.get("mqtt_host", "localhost"),
+                mqtt_port=config.get("mqtt_port", 1883),
+                backend_url=self._backend_defecto(config),
+                poll_config_interval=self._poll_interval(config),
+                trazar=config.get("tracing", False)
             )
-            self.devices[serial] = d
-            created.append(d)
+            self.devices.update(zip(seriales, created))
+            self._indexar(created)
+            self.gateways.asignar(created)
+        finally:
+            if gc_activo:
+                gc.enable()
         return created
 
+    # ----------- Snapshot / reinicio en caliente -----------
+    def save_snapshot(self, path):
+        """Guarda la flota completa (seriales, plantilla, parámetros, inyecciones, ids) en binario."""
+        t0 = time.perf_counter()
+        size = snapshot.guardar(self.devices.values(), path)
+        print(f"💾 Snapshot: {len(self.devices)} dispositivos, {size} bytes en {time.perf_counter() - t0:.3f}s")
+        return size
+
+    def load_snapshot(self, path):
+        """
+        Restaura la flota desde un snapshot (mmap) conservando identidades:
+        mismo serial, _device_id ya resuelto y último encendido sincronizado.
+        Los seriales que ya existen en el manager se omiten. Devuelve los creados.
+        """
+        t0 = time.perf_counter()
+        registros = snapshot.leer(path)
+        indice = self.registro.plantillas()
+
+        grupos = {}
+        omitidos = 0
+        for reg in registros:
+            if reg[0] in self.devices or indice.get(reg[1]) is None:
+                omitidos += 1
+                continue
+            grupos.setdefault(reg[1], []).append(reg)
+
+        config = self.config
+        created = []
+        gc_activo = gc.isenabled()
+        gc.disable()
+        try:
+            for nombre, regs in grupos.items():
+                tpl = indice[nombre]
+                lote = DeviceSimulator.crear_lote(
+                    [r[0] for r in regs],
+                    tpl,
+                    parametros=[r[5] for r in regs],
+                    mqtt_topic=config.get("mqtt_topic_estado", "dispositivos/estado"),
+                    interval=tpl.intervalo,
+                    mqtt_host=config.get("mqtt_host", "localhost"),
+                    mqtt_port=config.get("mqtt_port", 1883),
+                    backend_url=self._backend_defecto(config),
+                    poll_config_interval=self._poll_interval(config),
+                    trazar=config.get("tracing", False)
+                )
+                for d, (serial, _, device_id, apagado, sync, _, inyectados) in zip(lote, regs):
+                    d._device_id = device_id
+                    d.apagado = apagado
+                    d._last_encendido_sync = sync
+                    for k in inyectados:
+                        d.inyecciones[k] = True
+                    self.devices[serial] = d
+                self._indexar(lote)
+                self.gateways.asignar(lote)
+                created.extend(lote)
+        finally:
+            if gc_activo:
+                gc.enable()
+        print(f"📂 Snapshot cargado: {len(created)} dispositivos en {time.perf_counter() - t0:.3f}s"
+              + (f" ({omitidos} omitidos: serial existente o plantilla inexistente)" if omitidos else ""))
+        return created
+
+    # ----------- Config empujada por MQTT -----------
+    def _backend_defecto(self, config):
+        """Con backend_urls el backend real de cada dispositivo lo elige sharding.Enrutador."""
+        urls = config.get("backend_urls") or []
+        return config.get("backend_url") or (urls[0] if urls else None)
+
+    def _poll_interval(self, config):
+        """Con config_push, HTTP queda como reconciliación lenta."""
+        if config.get("config_push"):
+            return config.get("config_reconcile_interval", 60)
+        return config.get("poll_config_interval", 3)
+
+    def _configurar_push(self):
+        config = self.config
+        if self._push_sub is not None:
+            for cola in self._push_colas:
+                cola.desuscribir(self._push_sub[0])
+            self._push_sub = None
+            self._push_colas = []
+        if not config.get("config_push"):
+            return
+        plantilla = config.get("mqtt_topic_config", "dispositivos/{serial}/config")
+        niveles = plantilla.split("/")
+        if "{serial}" not in niveles:
+            print(f"⚠️ mqtt_topic_config debe contener un nivel '{{serial}}': {plantilla}")
+            return
+        idx = niveles.index("{serial}")
+        topic = "/".join("+" if n == "{serial}" else n for n in niveles)
+        # con varios brokers la config puede llegar por cualquiera: se suscribe en todos
+        self._push_colas = [obtener_cola(h, p, config) for h, p in enrutador().brokers]
+        for cola in self._push_colas:
+            cola.suscribir(topic, self._on_config_msg, qos=1)
+        self._push_sub = (topic, idx)
+        if self._push_thread is None:
+            self._push_thread = threading.Thread(target=self._aplicar_push, name="cfg-push", daemon=True)
+            self._push_thread.start()
+        print(f"📥 Config por MQTT activa en '{topic}' (HTTP cada {self._poll_interval(config)}s como respaldo)")
+
+    def _on_config_msg(self, topic, payload):
+        # hilo de red de paho: solo se encola
+        sub = self._push_sub
+        if sub is None:
+            return
+        niveles = topic.split("/")
+        if len(niveles) > sub[1]:
+            self._push_q.put((niveles[sub[1]], payload))
+
+    def _aplicar_push(self):
+        # solo parsea y entrega: el HTTP que pueda implicar lo hace el hilo cfg de cada dispositivo
+        while True:
+            serial, payload = self._push_q.get()
+            d = self.devices.get(serial)
+            if d is None:
+                continue
+            try:
+                d.recibir_config(json.loads(payload))
+            except ValueError as e:
+                print(f"[CFG] Config MQTT inválida para {serial}: {e}")
+            except Exception as e:
+                print(f"[CFG] Error aplicando config MQTT en {serial}: {e}")
+
+    def _on_recarga(self, cambios, plantillas_cambiadas):
+        """Empuja a los dispositivos los ajustes recargados por el registro."""
+        reenrutar = bool(set(CLAVES_ENRUTADOR) & set(cambios))
+        if reenrutar:
+            reconfigurar(self.config)
+        if reenrutar or {"config_push", "mqtt_topic_config"} & set(cambios):
+            self._configurar_push()
+        if set(CLAVES_COLA) & set(cambios):
+            reconfigurar_colas(self.config)
+        if set(CLAVES_GATEWAY) & set(cambios):
+            self.gateways.configurar(self.config)
+        if reenrutar:
+            self.gateways.reenrutar()
+        ajustes = {}
+        if "mqtt_host" in cambios:
+            ajustes["mqtt_host"] = cambios["mqtt_host"]
+        if "mqtt_port" in cambios:
+            ajustes["mqtt_port"] = cambios["mqtt_port"]
+        if "mqtt_topic_estado" in cambios:
+            ajustes["mqtt_topic"] = cambios["mqtt_topic_estado"]
+        if {"backend_url", "backend_urls"} & set(cambios):
+            ajustes["backend_url"] = self._backend_defecto(self.config)
+        if "tracing" in cambios:
+            ajustes["trazar"] = bool(cambios["tracing"])
+        if {"poll_config_interval", "config_push", "config_reconcile_interval"} & set(cambios):
+            ajustes["poll_config_interval"] = self._poll_interval(self.config)
+
+        nuevas = {}
+        if plantillas_cambiadas:
+            indice = self.registro.plantillas()
+            nuevas = {n: indice[n] for n in plantillas_cambiadas if n in indice}
+
+        if not ajustes and not nuevas and not reenrutar:
+            return
+        n = 0
+        for d in list(self.devices.values()):
+            if reenrutar:
+                d.reenrutar()
+            extra = {}
+            tpl = nuevas.get(d.plantilla.nombre_archivo) if d.plantilla is not None else None
+            if tpl is not None:
+                extra = {"reglas": tpl.reglas, "plantilla": tpl}
+                # el intervalo solo si cambió en la plantilla: no pisa un intervalo_envio del backend
+                if tpl.intervalo != d.plantilla.intervalo:
+                    extra["interval"] = tpl.intervalo
+            if ajustes or extra:
+                d.aplicar_ajustes(**ajustes, **extra)
+            if ajustes or extra or reenrutar:
+                n += 1
+        print(f"🔄 Configuración recargada: {n} dispositivos actualizados "
+              f"(config: {sorted(cambios) or '-'}, plantillas: {sorted(nuevas) or '-'})")
+
+    # ----------- Índices secundarios -----------
+    def _indexar(self, devices):
+        with self._idx_lock:
+            for d in devices:
+                nombre = d.plantilla.nombre_archivo if d.plantilla is not None else ""
+                self._por_plantilla.setdefault(nombre, set()).add(d.serial)
+                for campo in _INDICES_ESTADO:
+                    if getattr(d, campo):
+                        self._idx[campo].add(d.serial)
+                d._observador = self._on_cambio_estado
+
+    def _desindexar(self, d):
+        d._observador = None
+        with self._idx_lock:
+            nombre = d.plantilla.nombre_archivo if d.plantilla is not None else ""
+            grupo = self._por_plantilla.get(nombre)
+            if grupo is not None:
+                grupo.discard(d.serial)
+                if not grupo:
+                    del self._por_plantilla[nombre]
+            for idx in self._idx.values():
+                idx.discard(d.serial)
+
+    def _on_cambio_estado(self, d, campo, valor):
+        # llamado desde hilos de dispositivos / CLI: solo toca sets bajo lock
+        with self._idx_lock:
+            if d.serial not in self.devices:
+                return
+            if valor:
+                self._idx[campo].add(d.serial)
+            else:
+                self._idx[campo].discard(d.serial)
+
+    def _filtrar(self, plantilla=None, prefijo=None, **estado):
+        """Set de seriales que cumplen los filtros (None = no filtra). Requiere _idx_lock."""
+        if plantilla is not None:
+            base = set(self._por_plantilla.get(plantilla, ()))
+        elif prefijo is not None:
+            # por prefijo: plantillas cuyo serial_prefix es compatible + comprobación del serial
+            base = set()
+            indice = self.registro.plantillas()
+            for nombre, grupo in self._por_plantilla.items():
+                tpl = indice.get(nombre)
+                tpl_pre = tpl.serial_prefix if tpl is not None else ""
+                if not tpl_pre or tpl_pre.startswith(prefijo) or prefijo.startswith(tpl_pre):
+                    base.update(grupo)
+        else:
+            base = None
+
+        for campo, valor in estado.items():
+            if valor is None:
+                continue
+            if campo not in self._idx:
+                raise ValueError(f"filtro desconocido '{campo}' (válidos: {', '.join(_INDICES_ESTADO)})")
+            idx = self._idx[campo]
+            if base is None:
+                base = set(idx) if valor else set(self.devices).difference(idx)
+            elif valor:
+                base &= idx
+            else:
+                base -= idx
+        if base is None:
+            base = set(self.devices)
+        if prefijo is not None:
+            base = {s for s in base if s.startswith(prefijo)}
+        return base
+
+    def consultar(self, plantilla=None, prefijo=None, offset=0, limite=50, **estado):
+        """
+        Consulta indexada. Filtros: plantilla, prefijo y los estados
+        running / apagado / inyectado / reclamado (True/False; None = no filtra).
+        Devuelve (total, página de dispositivos ordenada por serial).
+        """
+        with self._idx_lock:
+            seriales = self._filtrar(plantilla, prefijo, **estado)
+        total = len(seriales)
+        pagina = sorted(seriales)[max(0, offset):max(0, offset) + max(0, limite)]
+        devices = self.devices
+        return total, [devices[s] for s in pagina if s in devices]
+
+    def agregados(self, plantilla=None, prefijo=None, **estado):
+        """Conteos de la selección: total, por estado y por plantilla."""
+        with self._idx_lock:
+            seriales = self._filtrar(plantilla, prefijo, **estado)
+            out = {"total": len(seriales)}
+            for campo, idx in self._idx.items():
+                out[campo] = len(seriales & idx)
+            por_plantilla = {}
+            for nombre, grupo in sorted(self._por_plantilla.items()):
+                n = len(grupo & seriales)
+                if n:
+                    por_plantilla[nombre] = n
+            out["por_plantilla"] = por_plantilla
+        return out
+
     def list_devices(self):
         return list(self.devices.values())
 
@@ -57,6 +364,8 @@ class DevicesManager:
     def remove(self, serial):
         d = self.devices.pop(serial, None)
         if d:
+            self._desindexar(d)
+            self.gateways.liberar(d)
             d.stop()
             return True
         return False
@@ -65,6 +374,23 @@ class DevicesManager:
         for d in self.devices.values():
             d.start()
 
-    def stop_all(self):
-        for d in self.devices.values():
-            d.stop()
+    def stop_all(self, timeout=5.0):
+        """
+        Detiene toda la flota en paralelo con un plazo total 'timeout':
+        primero señala a todos (los hilos dormidos despiertan de inmediato) y
+        luego espera a cada uno contra el mismo deadline.
+        Devuelve la lista de seriales que no se detuvieron a tiempo.
+        """
+        t0 = time.monotonic()
+        deadline = t0 + timeout
+        devices = list(self.devices.values())
+        for d in devices:
+            d.solicitar_parada()
+        fallidos = [d.serial for d in devices if not d.esperar_parada(deadline)]
+        self.gateways.vaciar()  # lotes abiertos: se publican sin esperar la ventana
+        if fallidos:
+            muestra = ", ".join(fallidos[:10]) + (" ..." if len(fallidos) > 10 else "")
+            print(f"⚠️ {len(fallidos)} dispositivos no se detuvieron en {timeout:g}s: {muestra}")
+        elif len(devices) > 1:
+            print(f"⏹️ {len(devices)} dispositivos detenidos en {time.monotonic() - t0:.3f}s")
+        return fallidos
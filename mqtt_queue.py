@@ -0,0 +1,399 @@
+# mqtt_queue.py
+"""
+Cola de salida MQTT compartida (una conexión por broker).
+
+- Ring buffer en memoria acotado ('capacidad' mensajes).
+- Spool opcional en disco: lo que no cabe en memoria se agrega a un archivo
+  (una línea JSON por mensaje) y se reinyecta en orden cuando hay espacio.
+  Mientras el spool tiene datos, lo nuevo también va al spool para no desordenar.
+- Reconexión con backoff exponencial: la hace el loop de paho sobre UNA sola
+  conexión por broker, en lugar de que cada dispositivo reconecte en su tick.
+- Control de tasa (token bucket, 'max_rate' mensajes/s) solo al reconectar:
+  se arma en _on_connect con el backlog acumulado durante el corte y se
+  desarma al enviarlo (o al vaciarse la cola). En régimen normal no limita.
+
+Las claves mqtt_* de CLAVES_COLA se reaplican en caliente a las colas ya
+creadas (reconfigurar_colas, desde la recarga de config.json). Un cambio de
+'mqtt_spool_dir' con spool pendiente espera a que ese spool se consuma.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from profiler import PERFIL
+
+CLAVES_COLA = ("mqtt_queue_capacity", "mqtt_spool_dir", "mqtt_drain_rate",
+               "mqtt_backoff_max", "mqtt_qos")
+
+_mqtt_client = None
+
+def _paho():
+    """paho-mqtt se importa al crear la primera conexión, no al importar el módulo."""
+    global _mqtt_client
+    if _mqtt_client is None:
+        from paho.mqtt import client as mqtt_client
+        _mqtt_client = mqtt_client
+    return _mqtt_client
+
+class ColaSalidaMQTT:
+    def __init__(self, host, port=1883, capacidad=10000, spool_path=None, max_rate=0,
+                 backoff_min=1, backoff_max=60, qos=1, keepalive=60):
+        self.host = host
+        self.port = int(port)
+        self.capacidad = max(1, int(capacidad))
+        self.spool_path = spool_path
+        self.max_rate = float(max_rate or 0)
+        self.qos = int(qos)
+        self.keepalive = int(keepalive)
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+
+        self._ring = deque()
+        self._lock = threading.Lock()         # ring + spool
+        self._hay_datos = threading.Event()
+        self._conectado = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._subs = {}  # topic -> (qos, callback); se re-suscriben al reconectar
+        self._rezagados = 0  # backlog del último corte que aún se drena con límite de tasa
+        self._client = self._crear_cliente()
+
+        # Spool: offset de lectura y cantidad pendiente
+        self._spool_off = 0
+        self._spool_pend = 0
+        self._spool_f = None    # handle de escritura, abierto mientras dure el corte
+        self._spool_siguiente = None  # (path,) a usar cuando se consuma el spool actual
+        self._spool_error = False
+        if spool_path and os.path.exists(spool_path):
+            with open(spool_path, "rb") as f:
+                self._spool_pend = sum(1 for _ in f)
+            if self._spool_pend:
+                self._hay_datos.set()
+
+        # Métricas
+        self.encolados = 0
+        self.enviados = 0
+        self.descartados = 0
+        self.derramados = 0  # escritos al spool
+
+    # ----------- Productores (dispositivos) -----------
+    def encolar(self, topic, payload):
+        """Encola sin bloquear. Devuelve False si el mensaje se descartó."""
+        with self._lock:
+            self.encolados += 1
+            if self._spool_pend == 0 and len(self._ring) < self.capacidad:
+                self._ring.append((topic, payload))
+            elif not (self.spool_path and self._spool_escribir([(topic, payload)])):
+                # sin spool (o spool que falla): se pierde el más antiguo (semántica de ring buffer)
+                self._ring.append((topic, payload))
+                if len(self._ring) > self.capacidad:
+                    self._ring.popleft()
+                self.descartados += 1
+                self._hay_datos.set()
+                return False
+        self._hay_datos.set()
+        return True
+
+    # ----------- Spool en disco -----------
+    def _spool_escribir(self, mensajes):
+        """Agrega al spool (bajo _lock). Devuelve False si no se pudo escribir."""
+        try:
+            f = self._spool_f
+            if f is None:
+                d = os.path.dirname(self.spool_path)
+                if d:
+                    os.makedirs(d, exist_ok=True)
+                f = self._spool_f = open(self.spool_path, "a", encoding="utf-8")
+            for m in mensajes:
+                f.write(json.dumps(list(m), ensure_ascii=False) + "\n")
+        except OSError as e:
+            if not self._spool_error:
+                print(f"[MQTT ERROR] Spool {self.spool_path} no escribible ({e}); se descarta lo más antiguo")
+                self._spool_error = True
+            self._spool_cerrar()
+            return False
+        self._spool_error = False
+        self._spool_pend += len(mensajes)
+        self.derramados += len(mensajes)
+        return True
+
+    def _spool_cerrar(self):
+        f, self._spool_f = self._spool_f, None
+        if f is not None:
+            try:
+                f.close()
+            except OSError:
+                pass
+
+    def _spool_recargar(self):
+        """Pasa del spool al ring todo lo que quepa (bajo _lock)."""
+        libres = self.capacidad - len(self._ring)
+        if libres <= 0 or self._spool_pend == 0:
+            return
+        if self._spool_f is not None:
+            self._spool_f.flush()
+        leidos = 0
+        with open(self.spool_path, "r", encoding="utf-8") as f:
+            f.seek(self._spool_off)
+            while leidos < libres:
+                linea = f.readline()
+                if not linea:
+                    break
+                try:
+                    topic, payload = json.loads(linea)
+                    self._ring.append((topic, payload))
+                except ValueError:
+                    pass  # línea corrupta (p.ej. corte a mitad de escritura)
+                leidos += 1
+            self._spool_off = f.tell()
+            fin = not f.readline()
+        self._spool_pend = max(0, self._spool_pend - leidos)
+        if fin:
+            # spool consumido: se trunca y se vuelve a escribir en memoria
+            self._spool_cerrar()
+            open(self.spool_path, "w").close()
+            self._spool_off = 0
+            self._spool_pend = 0
+            if self._spool_siguiente is not None:
+                self.spool_path = self._spool_siguiente[0]
+                self._spool_siguiente = None
+
+    def ajustar(self, capacidad, spool_path, max_rate, backoff_max, qos):
+        """Aplica claves recargadas de config.json sin reconectar."""
+        with self._lock:
+            self.capacidad = max(1, int(capacidad))
+            self.max_rate = float(max_rate or 0)
+            if not self.max_rate:
+                self._rezagados = 0
+            self.qos = int(qos)
+            if spool_path != self.spool_path:
+                if self._spool_pend:
+                    # no se mezclan spools: el actual se termina de drenar antes de cambiar
+                    self._spool_siguiente = (spool_path,)
+                else:
+                    self._spool_cerrar()
+                    self.spool_path = spool_path
+                    self._spool_siguiente = None
+            else:
+                self._spool_siguiente = None
+        if backoff_max != self.backoff_max:
+            self.backoff_max = backoff_max
+            self._client.reconnect_delay_set(min_delay=self.backoff_min, max_delay=backoff_max)
+
+    # ----------- Conexión -----------
+    def _crear_cliente(self):
+        mqtt_client = _paho()
+        try:
+            c = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2)
+        except AttributeError:  # paho-mqtt < 2.0
+            c = mqtt_client.Client()
+        c.on_connect = self._on_connect
+        c.on_disconnect = self._on_disconnect
+        c.reconnect_delay_set(min_delay=self.backoff_min, max_delay=self.backoff_max)
+        return c
+
+    def _on_connect(self, client, userdata, flags, rc, *args):
+        if getattr(rc, "is_failure", rc != 0):
+            return
+        print(f"[MQTT] Conectado a {self.host}:{self.port}")
+        for topic, (qos, _) in list(self._subs.items()):
+            client.subscribe(topic, qos)
+        # lo acumulado durante el corte se drena con límite de tasa; lo nuevo no
+        self._rezagados = self.pendientes() if self.max_rate > 0 else 0
+        self._conectado.set()
+        self._hay_datos.set()
+
+    def _on_disconnect(self, client, userdata, *args):
+        if self._conectado.is_set():
+            print(f"[MQTT] Desconectado de {self.host}:{self.port}; reintentando con backoff")
+        self._conectado.clear()
+
+    # ----------- Suscripciones (misma conexión) -----------
+    def suscribir(self, topic, callback, qos=1):
+        """
+        callback(topic: str, payload: bytes), invocado en el hilo de red de paho:
+        debe ser rápido (encolar y volver).
+        """
+        def _cb(client, userdata, msg):
+            try:
+                callback(msg.topic, msg.payload)
+            except Exception as e:
+                print(f"[MQTT] Error procesando mensaje de {msg.topic}: {e}")
+        self._subs[topic] = (qos, callback)
+        self._client.message_callback_add(topic, _cb)
+        if self._conectado.is_set():
+            self._client.subscribe(topic, qos)
+
+    def desuscribir(self, topic):
+        if self._subs.pop(topic, None) is not None:
+            self._client.message_callback_remove(topic)
+            if self._conectado.is_set():
+                self._client.unsubscribe(topic)
+
+    # ----------- Drenaje -----------
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        # connect_async + loop_start: el hilo de paho reintenta con backoff exponencial
+        self._client.connect_async(self.host, self.port, keepalive=self.keepalive)
+        self._client.loop_start()
+        self._thread = threading.Thread(target=self._drenar, name=f"mqtt:{self.host}:{self.port}", daemon=True)
+        self._thread.start()
+
+    def _siguiente(self):
+        with self._lock:
+            if not self._ring and self._spool_pend:
+                self._spool_recargar()
+            if self._ring:
+                return self._ring.popleft()
+            self._rezagados = 0
+            self._hay_datos.clear()
+            return None
+
+    def _drenar(self):
+        exito = _paho().MQTT_ERR_SUCCESS
+        tokens = 1.0
+        ultimo = time.monotonic()
+        while not self._stop.is_set():
+            if not self._conectado.wait(0.5):
+                continue
+            msg = self._siguiente()
+            if msg is None:
+                self._hay_datos.wait(0.5)
+                continue
+
+            if self._rezagados > 0:
+                ahora = time.monotonic()
+                tokens = min(self.max_rate, tokens + (ahora - ultimo) * self.max_rate)
+                ultimo = ahora
+                if tokens < 1:
+                    time.sleep((1 - tokens) / self.max_rate)
+                    tokens = 1.0
+                tokens -= 1
+                self._rezagados -= 1
+            else:
+                ultimo = time.monotonic()
+
+            topic, payload = msg
+            t0 = time.perf_counter() if PERFIL.activo else None
+            try:
+                info = self._client.publish(topic, payload, qos=self.qos)
+                ok = info.rc == exito
+            except Exception as e:
+                print("[MQTT ERROR]", e)
+                ok = False
+            if t0 is not None:
+                # envío real al broker (la fase "publish" del dispositivo es solo encolar)
+                PERFIL.registrar("drain", time.perf_counter() - t0)
+            if ok:
+                self.enviados += 1
+            else:
+                # vuelve al frente de la cola y espera a que se restablezca la conexión
+                with self._lock:
+                    self._ring.appendleft(msg)
+                if self._client.is_connected():
+                    time.sleep(0.05)  # buffer de paho lleno: breve pausa
+                else:
+                    self._conectado.clear()
+
+    def stop(self, timeout=2.0):
+        """Intenta vaciar la cola hasta 'timeout'; lo que quede va al spool (si hay)."""
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._conectado.is_set() and self.pendientes() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stop.set()
+        self._thread.join(timeout=max(0.1, deadline - time.monotonic()))
+        self._thread = None
+        try:
+            self._client.loop_stop()
+            self._client.disconnect()
+        except Exception:
+            pass
+        with self._lock:
+            self._spool_cerrar()
+            if self._ring and self.spool_path:
+                # conserva el orden: lo de memoria es más antiguo que lo del spool
+                resto = list(self._ring) + self._spool_leer_resto()
+                self._ring.clear()
+                d = os.path.dirname(self.spool_path)
+                if d:
+                    os.makedirs(d, exist_ok=True)
+                tmp = self.spool_path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    for m in resto:
+                        f.write(json.dumps(m, ensure_ascii=False) + "\n")
+                os.replace(tmp, self.spool_path)
+                self._spool_off = 0
+                self._spool_pend = len(resto)
+
+    def _spool_leer_resto(self):
+        if not self._spool_pend:
+            return []
+        out = []
+        with open(self.spool_path, "r", encoding="utf-8") as f:
+            f.seek(self._spool_off)
+            for linea in f:
+                try:
+                    out.append(json.loads(linea))
+                except ValueError:
+                    pass
+        return out
+
+    # ----------- Estado -----------
+    def pendientes(self):
+        return len(self._ring) + self._spool_pend
+
+    @property
+    def conectado(self):
+        return self._conectado.is_set()
+
+    def resumen(self):
+        return (f"{self.host}:{self.port} {'conectado' if self.conectado else 'DESCONECTADO'} | "
+                f"en memoria {len(self._ring)} | en spool {self._spool_pend} | "
+                f"enviados {self.enviados} | descartados {self.descartados}")
+
+# ---------------- Registro de colas (una por broker) ----------------
+_COLAS = {}
+_COLAS_LOCK = threading.Lock()
+
+def _opciones(host, port, config):
+    spool_dir = config.get("mqtt_spool_dir")
+    return {
+        "capacidad": config.get("mqtt_queue_capacity", 10000),
+        "spool_path": os.path.join(spool_dir, f"mqtt_{host}_{port}.spool") if spool_dir else None,
+        "max_rate": config.get("mqtt_drain_rate", 0),
+        "backoff_max": config.get("mqtt_backoff_max", 60),
+        "qos": config.get("mqtt_qos", 1),
+    }
+
+def obtener_cola(host, port=1883, config=None):
+    key = (host, int(port))
+    cola = _COLAS.get(key)
+    if cola is not None:
+        return cola
+    with _COLAS_LOCK:
+        cola = _COLAS.get(key)
+        if cola is None:
+            cola = ColaSalidaMQTT(host, port, **_opciones(host, port, config or {}))
+            cola.start()
+            _COLAS[key] = cola
+    return cola
+
+def listar_colas():
+    return list(_COLAS.values())
+
+def reconfigurar_colas(config):
+    """Reaplica CLAVES_COLA a todas las colas abiertas (tras recargar config.json)."""
+    for c in listar_colas():
+        c.ajustar(**_opciones(c.host, c.port, config))
+
+def cerrar_colas(timeout=2.0):
+    with _COLAS_LOCK:
+        colas = list(_COLAS.values())
+        _COLAS.clear()
+    for c in colas:
+        c.stop(timeout)
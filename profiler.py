@@ -0,0 +1,190 @@
+# profiler.py
+"""
+Perfilado activable en caliente.
+
+- Tiempos por fase (step, encode, publish, poll, schedule, y drain para el
+  envío real de la cola MQTT): los puntos de medición hacen `if PERFIL.activo:`
+  antes de tomar tiempos, así que apagado el costo es una lectura de atributo.
+- Muestreo de pilas: un hilo lee sys._current_frames() cada 'intervalo_s'
+  y acumula pilas colapsadas por rol de hilo (sim, cfg, mqtt, ...). Solo se
+  guardan los hilos que consumieron CPU desde el muestreo anterior (reloj de
+  CPU por hilo de Linux), así las esperas dentro de C (time.sleep,
+  Lock.acquire, sockets) no aparecen como trabajo. Sin ese reloj (otros
+  sistemas) se descartan las hojas de espera conocidas y el resumen se
+  rotula como reloj de pared. El hilo principal y el muestreador no cuentan.
+- Al detener: archivo de pilas colapsadas (formato de flamegraph.pl /
+  speedscope: "marco;marco;marco N") y resumen top-N.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+FASES = ("step", "encode", "publish", "poll", "schedule")
+
+# Hojas de pila de un hilo dormido/bloqueado (no consumen CPU)
+HOJAS_INACTIVAS = frozenset((
+    "threading.py:wait", "threading.py:_wait_for_tstate_lock",
+    "queue.py:get", "selectors.py:select",
+))
+# Fracción del intervalo con CPU por debajo de la cual el hilo se considera dormido
+CPU_MIN = 0.05
+
+def _reloj_cpu(tid):
+    """clockid del tiempo de CPU del hilo 'tid' (native_id) en Linux, igual que pthread_getcpuclockid."""
+    return ((~tid) << 3) | 6  # CPUCLOCK_PERTHREAD | CPUCLOCK_SCHED
+
+def _cpu_por_hilo_disponible():
+    if not sys.platform.startswith("linux") or not hasattr(time, "clock_gettime"):
+        return False
+    try:
+        time.clock_gettime(_reloj_cpu(threading.get_native_id()))
+        return True
+    except (OSError, AttributeError):
+        return False
+
+class Perfilador:
+    def __init__(self):
+        self.activo = False
+        self._lock = threading.Lock()
+        self._fases = {}           # fase -> [n, total_s, max_s]
+        self._pilas = Counter()    # "rol;marco;..." -> muestras
+        self._muestras = 0
+        self._inactivas = 0        # muestras de hilos dormidos (no se guardan)
+        self._t0 = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.intervalo_s = 0.01
+        self.cpu = _cpu_por_hilo_disponible()  # False: muestreo de reloj de pared
+
+    # ----------- Control -----------
+    def iniciar(self, intervalo_s=None):
+        if self.activo:
+            return
+        self.intervalo_s = intervalo_s or self.intervalo_s
+        with self._lock:
+            self._fases = {}
+            self._pilas = Counter()
+            self._muestras = 0
+            self._inactivas = 0
+        self._t0 = time.perf_counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._muestrear, name="perfil", daemon=True)
+        self._thread.start()
+        self.activo = True
+        print(f"🔬 Perfilado activo (muestreo cada {self.intervalo_s * 1000:.0f} ms)")
+
+    def detener(self, ruta=None, top=15):
+        """Detiene, escribe las pilas colapsadas en 'ruta' (si se da) y devuelve el resumen."""
+        if not self.activo:
+            return ""
+        self.activo = False
+        self._stop.set()
+        self._thread.join(timeout=1)
+        self._thread = None
+        if ruta:
+            self.volcar(ruta)
+        resumen = self.resumen(top)
+        print(resumen)
+        return resumen
+
+    # ----------- Fases -----------
+    def registrar(self, fase, dt):
+        with self._lock:
+            st = self._fases.get(fase)
+            if st is None:
+                self._fases[fase] = [1, dt, dt]
+            else:
+                st[0] += 1
+                st[1] += dt
+                if dt > st[2]:
+                    st[2] = dt
+
+    # ----------- Muestreo de pilas -----------
+    def _muestrear(self):
+        excluidos = {threading.get_ident(), threading.main_thread().ident}
+        cpu_previo = {}  # ident -> segundos de CPU en el muestreo anterior
+        t_previo = time.monotonic()
+        while not self._stop.wait(self.intervalo_s):
+            hilos = {t.ident: t for t in threading.enumerate()}
+            frames = sys._current_frames()
+            ahora = time.monotonic()
+            umbral = (ahora - t_previo) * CPU_MIN
+            t_previo = ahora
+            cpu_actual = {}
+            muestras = []
+            inactivas = 0
+            for ident, frame in frames.items():
+                if ident in excluidos:
+                    continue
+                if self.cpu:
+                    th = hilos.get(ident)
+                    try:
+                        cpu = time.clock_gettime(_reloj_cpu(th.native_id))
+                    except (OSError, AttributeError, TypeError):
+                        continue  # el hilo terminó entre enumerate() y la lectura
+                    cpu_actual[ident] = cpu
+                    previo = cpu_previo.get(ident)
+                    if previo is None or cpu - previo < umbral:
+                        inactivas += 1
+                        continue
+                else:
+                    co = frame.f_code
+                    if f"{os.path.basename(co.co_filename)}:{co.co_name}" in HOJAS_INACTIVAS:
+                        inactivas += 1
+                        continue
+                pila = []
+                f = frame
+                while f is not None:
+                    co = f.f_code
+                    pila.append(f"{os.path.basename(co.co_filename)}:{co.co_name}")
+                    f = f.f_back
+                th = hilos.get(ident)
+                rol = (th.name if th is not None else "?").split(":", 1)[0]
+                pila.append(rol)
+                muestras.append(";".join(reversed(pila)))
+            del frames
+            cpu_previo = cpu_actual
+            with self._lock:
+                self._pilas.update(muestras)
+                self._muestras += 1
+                self._inactivas += inactivas
+
+    # ----------- Salida -----------
+    def volcar(self, ruta):
+        with self._lock:
+            pilas = list(self._pilas.items())
+        with open(ruta, "w", encoding="utf-8") as f:
+            for pila, n in sorted(pilas):
+                f.write(f"{pila} {n}\n")
+        print(f"🔥 Pilas colapsadas en {ruta} (flamegraph.pl / speedscope)")
+
+    def resumen(self, top=15):
+        with self._lock:
+            fases = {k: list(v) for k, v in self._fases.items()}
+            pilas = Counter(self._pilas)
+            muestras = self._muestras
+            inactivas = self._inactivas
+        dur = time.perf_counter() - (self._t0 or time.perf_counter())
+        lineas = [f"=== Perfil ({dur:.1f}s, {muestras} muestreos) ==="]
+        lineas.append(f"{'fase':<10}{'n':>10}{'total s':>12}{'media ms':>12}{'max ms':>10}")
+        for fase in FASES + tuple(k for k in fases if k not in FASES):
+            if fase in fases:
+                n, tot, mx = fases[fase]
+                lineas.append(f"{fase:<10}{n:>10}{tot:>12.3f}{tot / n * 1000:>12.3f}{mx * 1000:>10.2f}")
+
+        # tiempo propio por función (hoja de cada pila)
+        propias = Counter()
+        for pila, n in pilas.items():
+            propias[pila.rsplit(";", 1)[-1]] += n
+        total = sum(propias.values()) or 1
+        reloj = "con CPU" if self.cpu else "reloj de pared: incluye esperas dentro de C"
+        lineas.append(f"--- top {top} funciones (muestras propias, {reloj}; "
+                      f"{inactivas} de hilos dormidos omitidas) ---")
+        for func, n in propias.most_common(top):
+            lineas.append(f"{n:>8} {n * 100 / total:6.1f}%  {func}")
+        return "\n".join(lineas)
+
+# Perfilador compartido por todo el proceso
+PERFIL = Perfilador()
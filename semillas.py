@@ -0,0 +1,109 @@
+# semillas.py
+"""
+Semilla de la corrida y flujos aleatorios derivados.
+
+Con una misma semilla (config.json "seed" o main.py --semilla) y la misma
+secuencia de operaciones, la corrida se repite bit a bit:
+
+- flujo(*claves): random.Random nuevo sembrado con blake2b(semilla, claves).
+  Es función pura de (semilla, claves), así que cada dispositivo (clave =
+  serial) tiene su propio generador: sin estado compartido entre hilos y
+  derivable igual desde otro proceso.
+- flujo_compartido(*claves): el mismo flujo, pero cacheado y persistente
+  (p.ej. generación de seriales por prefijo, que debe avanzar entre llamadas).
+- generador_np(rng): numpy.random.Generator sembrado desde un flujo (cohortes).
+- reloj_inicio(): segundo del día simulado en que arranca el reloj de los
+  dispositivos (config "sim_start" HH:MM, o derivado de la semilla). Las
+  señales avanzan con ese reloj tick a tick, no con la hora de la máquina.
+"""
+import hashlib
+import os
+import random
+import threading
+
+_semilla = None
+_informada = False  # iniciar() ya mostró la semilla
+_inicio = None  # segundo del día de "sim_start" (None = derivado de la semilla)
+_lock = threading.Lock()
+_compartidos = {}
+
+def fijar_semilla(semilla):
+    """Fija la semilla de la corrida (int o str). Reinicia los flujos compartidos."""
+    global _semilla
+    with _lock:
+        _semilla = int(semilla) if str(semilla).lstrip("-").isdigit() else str(semilla)
+        _compartidos.clear()
+    return _semilla
+
+def iniciar(semilla=None):
+    """
+    Fija 'semilla' si aún no hay una (p.ej. de --semilla); sin semilla usa una
+    aleatoria. La informa una vez, también si venía fijada, para poder repetir.
+    """
+    global _informada
+    if _semilla is None:
+        if semilla is None:
+            semilla = int.from_bytes(os.urandom(8), "little")
+        fijar_semilla(semilla)
+    s = _semilla
+    if _informada:
+        return s
+    _informada = True
+    ini = int(reloj_inicio())
+    print(f"🎲 Semilla de la corrida: {s} (config.json \"seed\" o --semilla para repetirla); "
+          f"reloj simulado desde las {ini // 3600:02d}:{ini % 3600 // 60:02d}")
+    return s
+
+def fijar_inicio(hhmm):
+    """Hora simulada de arranque "HH:MM" (None = derivada de la semilla)."""
+    global _inicio
+    if hhmm is None:
+        _inicio = None
+        return
+    hh, mm = str(hhmm).split(":")
+    _inicio = (int(hh) * 3600 + int(mm) * 60) % 86400
+
+def reloj_inicio():
+    if _inicio is not None:
+        return float(_inicio)
+    return float(derivar("reloj") % 86400)
+
+def semilla():
+    return _semilla if _semilla is not None else iniciar()
+
+def derivar(*claves):
+    """Entero de 64 bits derivado de (semilla, claves)."""
+    data = "\x1f".join(str(c) for c in (semilla(),) + claves).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+def flujo(*claves):
+    return random.Random(derivar(*claves))
+
+def flujo_compartido(*claves):
+    r = _compartidos.get(claves)
+    if r is None:
+        with _lock:
+            r = _compartidos.get(claves)
+            if r is None:
+                r = _compartidos[claves] = flujo(*claves)
+    return r
+
+_np = False  # sin resolver aún
+
+def numpy_opcional():
+    """Módulo numpy, importado al primer uso (None si no está instalado)."""
+    global _np
+    if _np is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _np = numpy
+    return _np
+
+def generador_np(rng):
+    """numpy.random.Generator sembrado desde 'rng' (None si NumPy no está)."""
+    np = numpy_opcional()
+    if np is None:
+        return None
+    return np.random.Generator(np.random.PCG64(rng.getrandbits(64)))
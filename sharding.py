@@ -0,0 +1,165 @@
+# sharding.py
+"""
+Reparto de dispositivos entre varios brokers MQTT y backends HTTP.
+
+- config.json acepta listas: "mqtt_brokers" (["host:puerto", ...]) y
+  "backend_urls" (["http://...", ...]). Sin listas se usa mqtt_host/mqtt_port
+  y backend_url como siempre (un único nodo).
+- Cada serial se asigna por hash consistente (anillo con nodos virtuales +
+  bisect): agregar o quitar un endpoint solo mueve ~1/N de los dispositivos.
+- Pool por endpoint: una ColaSalidaMQTT (una conexión) por broker y una
+  requests.Session (conexiones keep-alive) por backend.
+- Failover por salud: si el nodo primario de un serial no está sano (broker
+  desconectado / backend que falló hace poco) se usa el siguiente del anillo,
+  y se vuelve al primario en cuanto se recupera.
+"""
+import bisect
+import hashlib
+import threading
+import time
+from mqtt_queue import obtener_cola
+from config_loader import get_config
+
+def _hash(clave):
+    return int.from_bytes(hashlib.blake2b(clave.encode("utf-8"), digest_size=8).digest(), "big")
+
+class AnilloHash:
+    def __init__(self, nodos, vnodes=256):
+        self.nodos = list(dict.fromkeys(nodos))  # sin duplicados, orden estable
+        if not self.nodos:
+            raise ValueError("el anillo necesita al menos un nodo")
+        puntos = sorted((_hash(f"{n}#{i}"), n) for n in self.nodos for i in range(max(1, int(vnodes))))
+        self._hashes = [h for h, _ in puntos]
+        self._nodo_de_punto = [n for _, n in puntos]
+
+    def nodo_para(self, clave):
+        if len(self.nodos) == 1:
+            return self.nodos[0]
+        i = bisect.bisect(self._hashes, _hash(clave)) % len(self._hashes)
+        return self._nodo_de_punto[i]
+
+    def candidatos(self, clave):
+        """Nodos distintos en orden de preferencia (primario primero) para 'clave'."""
+        if len(self.nodos) == 1:
+            return self.nodos
+        i = bisect.bisect(self._hashes, _hash(clave))
+        out = []
+        n = len(self._hashes)
+        for j in range(n):
+            nodo = self._nodo_de_punto[(i + j) % n]
+            if nodo not in out:
+                out.append(nodo)
+                if len(out) == len(self.nodos):
+                    break
+        return out
+
+def parsear_broker(s, puerto_defecto=1883):
+    """'host:puerto' | 'host' | ["host", puerto] → (host, puerto)."""
+    if isinstance(s, (list, tuple)):
+        return str(s[0]), int(s[1]) if len(s) > 1 else int(puerto_defecto)
+    s = str(s).strip()
+    if s.count(":") == 1:
+        host, port = s.split(":")
+        return host, int(port)
+    return s, int(puerto_defecto)
+
+class Enrutador:
+    def __init__(self, config):
+        self.config = config
+        puerto = config.get("mqtt_port", 1883)
+        brokers = config.get("mqtt_brokers") or [(config.get("mqtt_host", "localhost"), puerto)]
+        self.brokers = [parsear_broker(b, puerto) for b in brokers]
+        backends = config.get("backend_urls") or ([config["backend_url"]] if config.get("backend_url") else [])
+        self.backends = [str(u).rstrip("/") for u in backends]
+        vnodes = config.get("hash_vnodes", 256)
+        self._anillo_mqtt = AnilloHash([f"{h}:{p}" for h, p in self.brokers], vnodes)
+        self._anillo_http = AnilloHash(self.backends, vnodes) if self.backends else None
+        self.varios_brokers = len(self.brokers) > 1
+        self.varios_backends = len(self.backends) > 1
+        self.reintento_s = float(config.get("backend_retry_s", 15))
+        self._sesiones = {}
+        self._caidos = {}   # url -> time.monotonic() hasta el que se considera caído
+        self._lock = threading.Lock()
+
+    # ----------- MQTT -----------
+    def broker_para(self, serial):
+        return parsear_broker(self._anillo_mqtt.nodo_para(serial))
+
+    def cola_para(self, serial):
+        """(cola, es_primaria): primer broker conectado en el orden del anillo."""
+        colas = [obtener_cola(*parsear_broker(n), self.config) for n in self._anillo_mqtt.candidatos(serial)]
+        for c in colas:
+            if c.conectado:
+                return c, c is colas[0]
+        return colas[0], True  # ninguno sano: se encola en el primario
+
+    # ----------- HTTP -----------
+    def sesion(self, url):
+        s = self._sesiones.get(url)
+        if s is None:
+            with self._lock:
+                s = self._sesiones.get(url)
+                if s is None:
+                    # requests se importa con la primera sesión HTTP
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    s = requests.Session()
+                    tam = int(self.config.get("backend_pool_size", 32))
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=tam)
+                    s.mount("http://", adapter)
+                    s.mount("https://", adapter)
+                    self._sesiones[url] = s
+        return s
+
+    def sano(self, url):
+        hasta = self._caidos.get(url)
+        return hasta is None or time.monotonic() >= hasta
+
+    def marcar_caido(self, url):
+        if url in self.backends:
+            self._caidos[url] = time.monotonic() + self.reintento_s
+
+    def backend_para(self, serial):
+        if self._anillo_http is None:
+            return None
+        candidatos = self._anillo_http.candidatos(serial)
+        for url in candidatos:
+            if self.sano(url):
+                return url
+        return candidatos[0]
+
+    # ----------- Estado -----------
+    def reparto(self, seriales):
+        """Conteo de dispositivos por broker primario y por backend primario."""
+        mqtt, http = {}, {}
+        for s in seriales:
+            b = self._anillo_mqtt.nodo_para(s)
+            mqtt[b] = mqtt.get(b, 0) + 1
+            if self._anillo_http is not None:
+                u = self._anillo_http.nodo_para(s)
+                http[u] = http.get(u, 0) + 1
+        return mqtt, http
+
+# ---------------- Enrutador de la corrida ----------------
+CLAVES_ENRUTADOR = ("mqtt_brokers", "mqtt_host", "mqtt_port", "backend_urls", "backend_url",
+                    "hash_vnodes", "backend_retry_s", "backend_pool_size")
+_ENRUTADOR = None
+_LOCK = threading.Lock()
+
+def enrutador():
+    r = _ENRUTADOR
+    if r is None:
+        r = reconfigurar(get_config())
+    return r
+
+def reconfigurar(config):
+    """
+    Reconstruye el enrutador (p.ej. tras recargar config.json). El anterior no
+    se cierra: los hilos que lo tomaron con enrutador() pueden estar a mitad de
+    una petición con sus sesiones, que se liberan (y cierran sus sockets) cuando
+    el último de ellos suelta la referencia.
+    """
+    global _ENRUTADOR
+    with _LOCK:
+        _ENRUTADOR = Enrutador(config)
+    return _ENRUTADOR
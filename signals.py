@@ -0,0 +1,221 @@
+# signals.py
+"""
+Modelos de señal por parámetro (clave "senal" en la regla de la plantilla).
+
+Todo lo costoso se precalcula al compilar la plantilla, una vez para toda la
+flota: la curva diurna es una tabla de 1440 valores (uno por minuto del día)
+y el ruido gaussiano sale de una tabla fija de cuantiles normales, indexada con
+el generador propio del dispositivo (ver semillas.py). Por tick cada modelo hace
+una búsqueda en tabla, un par de multiplicaciones y un getrandbits(): lo mismo
+que el paseo aleatorio uniforme de siempre, y reproducible con la misma semilla.
+
+  diurno      → Ornstein–Uhlenbeck alrededor de una sinusoide de 24 h
+                {"tipo": "diurno", "media": 24, "amplitud": 4, "pico": "15:00", "tau": 600, "sigma": 0.3}
+  ou          → Ornstein–Uhlenbeck alrededor de una media fija
+                {"tipo": "ou", "media": 55, "tau": 120, "sigma": 8}
+  markov      → on/off con duraciones medias (ráfagas, ocupación)
+                {"tipo": "markov", "on_s": 60, "off_s": 900, "on": 75, "off": 38, "sigma": 2}
+  correlado   → sigue a otro parámetro: objetivo = base + pendiente × otro
+                {"tipo": "correlado", "con": "temperatura", "base": 110, "pendiente": -2.5, "tau": 300, "sigma": 1}
+
+tau: constante de tiempo (s) con la que el valor vuelve a su objetivo.
+sigma: desviación típica estacionaria del ruido alrededor del objetivo.
+now: segundos del reloj simulado del dispositivo (semillas.reloj_inicio() +
+los intervalos transcurridos), no la hora de la máquina: con la misma semilla
+la curva diurna se repite igual.
+"""
+import math
+from abc import ABC, abstractmethod
+
+TIPOS_SENAL = ("diurno", "ou", "markov", "correlado")
+MINUTOS_DIA = 1440
+BITS_POOL = 16
+
+class SenalInvalida(ValueError):
+    pass
+
+# ---------------- Ruido gaussiano precalculado ----------------
+_POOL = None
+
+def pool_normal():
+    """Tabla de 2**BITS_POOL cuantiles de N(0,1); determinista, se arma una sola vez."""
+    global _POOL
+    if _POOL is None:
+        from statistics import NormalDist
+        n = 1 << BITS_POOL
+        inv = NormalDist().inv_cdf
+        _POOL = tuple(inv((i + 0.5) / n) for i in range(n))
+    return _POOL
+
+def normal(rng):
+    return pool_normal()[rng.getrandbits(BITS_POOL)]
+
+# ---------------- Reloj simulado → minuto del día ----------------
+def minuto_del_dia(now):
+    return int(now // 60) % MINUTOS_DIA
+
+# ---------------- Modelos ----------------
+class Senal(ABC):
+    """
+    Base de los modelos: ruido de la tabla precalculada y coeficientes por
+    intervalo (dt) calculados una sola vez con _calcular().
+    """
+    depende_de = None
+
+    def __init__(self, sigma):
+        if sigma < 0:
+            raise SenalInvalida("'sigma' debe ser >= 0")
+        self.sigma = float(sigma)
+        self._coef = {}  # dt -> coeficientes de _calcular(dt)
+        self._pool = pool_normal()
+
+    def _coeficientes(self, dt):
+        c = self._coef.get(dt)
+        if c is None:
+            c = self._coef[dt] = self._calcular(dt)
+        return c
+
+    def _ruido(self, rng):
+        return self._pool[rng.getrandbits(BITS_POOL)]
+
+    @abstractmethod
+    def _calcular(self, dt):
+        """Coeficientes de la discretización para un intervalo dt."""
+
+    @abstractmethod
+    def inicial(self, params, now, rng):
+        """Primer valor del parámetro."""
+
+    @abstractmethod
+    def siguiente(self, actual, params, now, dt, rng):
+        """Valor tras dt segundos, a partir del actual."""
+
+class _Reversion(Senal):
+    """Ornstein–Uhlenbeck: x' = objetivo + a·(x − objetivo) + b·N(0,1)."""
+
+    def __init__(self, tau, sigma):
+        super().__init__(sigma)
+        if tau <= 0:
+            raise SenalInvalida("'tau' debe ser > 0")
+        self.tau = float(tau)
+
+    def _calcular(self, dt):
+        # discretización exacta por intervalo
+        a = math.exp(-dt / self.tau)
+        return a, self.sigma * math.sqrt(1.0 - a * a)
+
+    @abstractmethod
+    def objetivo(self, params, now):
+        """Valor al que vuelve la señal en el instante now."""
+
+    def inicial(self, params, now, rng):
+        return self.objetivo(params, now) + self.sigma * self._ruido(rng)
+
+    def siguiente(self, actual, params, now, dt, rng):
+        obj = self.objetivo(params, now)
+        if not isinstance(actual, (int, float)):
+            actual = obj
+        a, b = self._coeficientes(dt)
+        return obj + a * (actual - obj) + b * self._ruido(rng)
+
+class OrnsteinUhlenbeck(_Reversion):
+    def __init__(self, media, tau=60, sigma=1.0):
+        super().__init__(tau, sigma)
+        self.media = float(media)
+
+    def objetivo(self, params, now):
+        return self.media
+
+class Diurno(_Reversion):
+    def __init__(self, media, amplitud, pico="15:00", tau=600, sigma=0.3):
+        super().__init__(tau, sigma)
+        try:
+            hh, mm = str(pico).split(":")
+            pico_min = int(hh) * 60 + int(mm)
+        except ValueError:
+            raise SenalInvalida(f"'pico' debe ser HH:MM ({pico})")
+        w = 2 * math.pi / MINUTOS_DIA
+        self.tabla = tuple(float(media) + float(amplitud) * math.cos(w * (m - pico_min))
+                           for m in range(MINUTOS_DIA))
+
+    def objetivo(self, params, now):
+        return self.tabla[minuto_del_dia(now)]
+
+class Correlado(_Reversion):
+    def __init__(self, con, base=0.0, pendiente=1.0, tau=60, sigma=0.0):
+        super().__init__(tau, sigma)
+        if not isinstance(con, str) or not con:
+            raise SenalInvalida("'con' debe nombrar otro parámetro")
+        self.depende_de = con
+        self.base = float(base)
+        self.pendiente = float(pendiente)
+
+    def objetivo(self, params, now):
+        v = params.get(self.depende_de, 0)
+        # booleanos (p.ej. ocupación) cuentan como 0/1
+        return self.base + self.pendiente * float(v or 0)
+
+class Markov(Senal):
+    """Cadena de dos estados; sobre parámetros numéricos publica 'on'/'off' (+ ruido)."""
+
+    def __init__(self, on_s=60, off_s=600, on=True, off=False, sigma=0.0):
+        super().__init__(sigma)
+        if on_s <= 0 or off_s <= 0:
+            raise SenalInvalida("'on_s' y 'off_s' deben ser > 0")
+        self.on_s = float(on_s)
+        self.off_s = float(off_s)
+        self.on = on
+        self.off = off
+        self._numerico = not isinstance(on, bool)
+
+    def _calcular(self, dt):
+        # (p salir de on, p salir de off)
+        return 1.0 - math.exp(-dt / self.on_s), 1.0 - math.exp(-dt / self.off_s)
+
+    def _valor(self, encendido, rng):
+        v = self.on if encendido else self.off
+        if self._numerico and self.sigma:
+            return v + self.sigma * self._ruido(rng)
+        return v
+
+    def _encendido(self, actual):
+        if not self._numerico:
+            return bool(actual)
+        # el estado se deduce del valor publicado: el más cercano a 'on' u 'off'
+        return abs(actual - self.on) < abs(actual - self.off)
+
+    def inicial(self, params, now, rng):
+        # estado estacionario: fracción del tiempo encendido
+        return self._valor(rng.random() < self.on_s / (self.on_s + self.off_s), rng)
+
+    def siguiente(self, actual, params, now, dt, rng):
+        if not isinstance(actual, (int, float)):
+            return self.inicial(params, now, rng)
+        encendido = self._encendido(actual)
+        p_on_off, p_off_on = self._coeficientes(dt)
+        if rng.random() < (p_on_off if encendido else p_off_on):
+            encendido = not encendido
+        return self._valor(encendido, rng)
+
+_CONSTRUCTORES = {
+    "diurno": Diurno,
+    "ou": OrnsteinUhlenbeck,
+    "markov": Markov,
+    "correlado": Correlado,
+}
+
+def compilar_senal(spec):
+    """dict de la plantilla → modelo compilado (None si no hay 'senal')."""
+    if spec is None:
+        return None
+    if not isinstance(spec, dict):
+        raise SenalInvalida("'senal' debe ser un objeto")
+    tipo = spec.get("tipo")
+    cls = _CONSTRUCTORES.get(tipo)
+    if cls is None:
+        raise SenalInvalida(f"tipo de señal desconocido '{tipo}' (válidos: {', '.join(TIPOS_SENAL)})")
+    kwargs = {k: v for k, v in spec.items() if k != "tipo"}
+    try:
+        return cls(**kwargs)
+    except TypeError as e:
+        raise SenalInvalida(f"señal '{tipo}': {e}")
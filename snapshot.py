@@ -0,0 +1,186 @@
+# snapshot.py
+"""
+Snapshot binario compacto de la flota (para reinicios en caliente).
+
+Formato (little-endian):
+  cabecera   MAGIC(8) version(u16) n_plantillas(u32) n_claves(u32) n_dispositivos(u64)
+  tablas     n_plantillas + n_claves strings (u16 largo + utf-8)
+  registros  por dispositivo:
+               serial (u16 largo + utf-8), plantilla (u32 índice), flags (u8),
+               device_id (valor), n_params (u16) + [clave (u32 índice), valor]...,
+               n_inyectados (u16) + [clave (u32 índice)]...
+  valor      tag (u8) + datos: None / False / True / int64 / float64 / str (u32 + utf-8) / JSON
+flags: bit0 = apagado, bits1-2 = último encendido sincronizado (0 None, 1 False, 2 True)
+"""
+import json
+import mmap
+import os
+import struct
+
+MAGIC = b"IOTSNAP\x00"
+VERSION = 1
+
+_HEADER = struct.Struct("<8sHIIQ")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+_REC = struct.Struct("<IB")   # plantilla, flags
+
+T_NONE, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_STR, T_JSON = range(7)
+_INT64_MIN, _INT64_MAX = -(2 ** 63), 2 ** 63 - 1
+
+class SnapshotInvalido(ValueError):
+    pass
+
+# ---------------- Escritura ----------------
+def _pack_str(buf, s, largo=_U16):
+    b = s.encode("utf-8")
+    buf += largo.pack(len(b))
+    buf += b
+
+def _pack_valor(buf, v):
+    if v is None:
+        buf.append(T_NONE)
+    elif v is True:
+        buf.append(T_TRUE)
+    elif v is False:
+        buf.append(T_FALSE)
+    elif isinstance(v, int) and _INT64_MIN <= v <= _INT64_MAX:
+        buf.append(T_INT)
+        buf += _I64.pack(v)
+    elif isinstance(v, float):
+        buf.append(T_FLOAT)
+        buf += _F64.pack(v)
+    elif isinstance(v, str):
+        buf.append(T_STR)
+        _pack_str(buf, v, _U32)
+    else:
+        buf.append(T_JSON)
+        _pack_str(buf, json.dumps(v, ensure_ascii=False), _U32)
+
+def _flags(d):
+    sync = d._last_encendido_sync
+    return (1 if d.apagado else 0) | ((0 if sync is None else 2 if sync else 1) << 1)
+
+def guardar(devices, ruta):
+    """Escribe el snapshot de 'devices' (iterable de DeviceSimulator) en 'ruta' de forma atómica."""
+    devices = list(devices)
+    # una instantánea por dispositivo (lectura sin locks, ver DeviceSimulator.parametros)
+    snaps = [d.parametros for d in devices]
+    tpl_idx, claves_idx = {}, {}
+    for d, params in zip(devices, snaps):
+        nombre = d.plantilla.nombre_archivo if d.plantilla is not None else ""
+        tpl_idx.setdefault(nombre, len(tpl_idx))
+        for k in params:
+            claves_idx.setdefault(k, len(claves_idx))
+
+    buf = bytearray(_HEADER.pack(MAGIC, VERSION, len(tpl_idx), len(claves_idx), len(devices)))
+    for nombre in tpl_idx:
+        _pack_str(buf, nombre)
+    for k in claves_idx:
+        _pack_str(buf, k)
+
+    for d, params in zip(devices, snaps):
+        nombre = d.plantilla.nombre_archivo if d.plantilla is not None else ""
+        _pack_str(buf, d.serial)
+        buf += _REC.pack(tpl_idx[nombre], _flags(d))
+        _pack_valor(buf, d._device_id)
+        buf += _U16.pack(len(params))
+        for k, v in params.items():
+            buf += _U32.pack(claves_idx[k])
+            _pack_valor(buf, v)
+        inyectados = [k for k, on in d.inyecciones.items() if on and k in claves_idx]
+        buf += _U16.pack(len(inyectados))
+        for k in inyectados:
+            buf += _U32.pack(claves_idx[k])
+
+    tmp = f"{ruta}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(buf)
+    os.replace(tmp, ruta)
+    return len(buf)
+
+# ---------------- Lectura (mmap) ----------------
+def _unpack_str(mv, off, largo=_U16):
+    (n,) = largo.unpack_from(mv, off)
+    off += largo.size
+    return str(mv[off:off + n], "utf-8"), off + n
+
+def _unpack_valor(mv, off):
+    tag = mv[off]
+    off += 1
+    if tag == T_NONE:
+        return None, off
+    if tag == T_FALSE:
+        return False, off
+    if tag == T_TRUE:
+        return True, off
+    if tag == T_INT:
+        return _I64.unpack_from(mv, off)[0], off + 8
+    if tag == T_FLOAT:
+        return _F64.unpack_from(mv, off)[0], off + 8
+    if tag == T_STR:
+        return _unpack_str(mv, off, _U32)
+    if tag == T_JSON:
+        s, off = _unpack_str(mv, off, _U32)
+        return json.loads(s), off
+    raise SnapshotInvalido(f"tag de valor desconocido {tag} en offset {off - 1}")
+
+def leer(ruta):
+    """
+    Lee el snapshot vía mmap. Devuelve una lista de registros:
+      (serial, nombre_plantilla, device_id, apagado, encendido_sync, parametros, inyectados)
+    """
+    with open(ruta, "rb") as f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            raise SnapshotInvalido("archivo demasiado corto")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            mv = memoryview(mm)
+            try:
+                return _leer_registros(mv)
+            except (struct.error, IndexError, UnicodeDecodeError) as e:
+                raise SnapshotInvalido(f"snapshot truncado o corrupto: {e}")
+            finally:
+                mv.release()
+
+def _leer_registros(mv):
+    magic, version, n_tpl, n_claves, n_dev = _HEADER.unpack_from(mv, 0)
+    if magic != MAGIC:
+        raise SnapshotInvalido("no es un snapshot de IoT Alchemy")
+    if version != VERSION:
+        raise SnapshotInvalido(f"versión de snapshot no soportada: {version}")
+    off = _HEADER.size
+    plantillas, claves = [], []
+    for _ in range(n_tpl):
+        s, off = _unpack_str(mv, off)
+        plantillas.append(s)
+    for _ in range(n_claves):
+        s, off = _unpack_str(mv, off)
+        claves.append(s)
+
+    u16, u32, rec = _U16.unpack_from, _U32.unpack_from, _REC.unpack_from
+    registros = []
+    append = registros.append
+    for _ in range(n_dev):
+        serial, off = _unpack_str(mv, off)
+        tpl, flags = rec(mv, off)
+        off += _REC.size
+        device_id, off = _unpack_valor(mv, off)
+        (n_params,) = u16(mv, off)
+        off += 2
+        params = {}
+        for _ in range(n_params):
+            (k,) = u32(mv, off)
+            v, off = _unpack_valor(mv, off + 4)
+            params[claves[k]] = v
+        (n_iny,) = u16(mv, off)
+        off += 2
+        inyectados = []
+        for _ in range(n_iny):
+            inyectados.append(claves[u32(mv, off)[0]])
+            off += 4
+        sync = (flags >> 1) & 0b11
+        append((serial, plantillas[tpl], device_id, bool(flags & 1),
+                None if sync == 0 else sync == 2, params, inyectados))
+    return registros
@@ -1,17 +1,351 @@
 # templates_loader.py
 import os
 import json
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from signals import compilar_senal, SenalInvalida, Markov
 
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
 
+# ------------------------------------
+# Detección de "kind" y capability/canal
+# ------------------------------------
+# 1) Kind por prefijo de serial (fallback si no lo da la config)
+KIND_BY_SERIAL_PREFIX = {
+    "LGT0": "luz",
+    "RGD0": "riego",
+    "SHD0": "persiana",
+    "FAN0": "ventilador",
+    "DRL0": "puerta",
+    "TMP0": "termometro",
+    "CAM0": "camara",
+    "PLG0": "enchufe",
+    "LUX0": "sensor_luz",
+    "CO20": "sensor_co2",
+    "SMK0": "sensor_humo",
+    "MOV0": "sensor_mov",
+    "SND0": "sensor_ruido",
+}
+# Longitudes de prefijo existentes (de mayor a menor) para buscar por slicing en O(1)
+_PREFIX_LENS = tuple(sorted({len(p) for p in KIND_BY_SERIAL_PREFIX}, reverse=True))
+
+# 2) Canal recomendado por kind (coincide con el plan de “canales”)
+CHANNEL_BY_KIND = {
+    "luz": "horarios",
+    "enchufe": "horarios",
+    "camara": "horarios",          # se trata como binario
+    "persiana": "horarios_pos",
+    "cortina": "horarios_pos",
+    "riego": "horarios_riego",
+    "ventilador": "horarios_speed",
+    "puerta": "horarios_lock",
+    "termometro": "horarios_temp",
+    "aire": "horarios_temp",
+    # Sensores → sin programación propia (usa solo intervalo_envio)
+}
+
+# 3) Capability por kind
+CAPABILITY_BY_KIND = {
+    "luz": "binary",
+    "enchufe": "binary",
+    "camara": "binary",
+    "persiana": "position",
+    "cortina": "position",
+    "ventilador": "speed",
+    "puerta": "lock",
+    "riego": "duration",
+    "termometro": "setpoint",
+    "aire": "setpoint",
+    # sensores → "sensor" (solo lectura)
+    "sensor_luz": "sensor",
+    "sensor_co2": "sensor",
+    "sensor_humo": "sensor",
+    "sensor_mov": "sensor",
+    "sensor_ruido": "sensor",
+}
+
+def kind_por_serial(serial):
+    """Kind según prefijo del serial (None si no hay coincidencia)."""
+    s = str(serial)
+    for n in _PREFIX_LENS:
+        kind = KIND_BY_SERIAL_PREFIX.get(s[:n])
+        if kind:
+            return kind
+    return None
+
+def guess_kind(serial, cfg=None, default="luz"):
+    # prioridad: configuracion.kind / configuracion.subtipo → prefijo serial → fallback
+    cfg = cfg or {}
+    for key in ("kind", "subtipo"):
+        v = cfg.get(key)
+        if v:
+            return str(v).strip().lower()
+    # si no hay pista, asume binario
+    return kind_por_serial(serial) or default
+
+def capability_for_kind(kind):
+    return CAPABILITY_BY_KIND.get(kind, "binary")
+
+def channel_for_kind(kind):
+    return CHANNEL_BY_KIND.get(kind, "horarios")
+
+# ------------------------------------
+# Plantillas compiladas
+# ------------------------------------
+TIPOS_NUMERICOS = ("float", "double", "int")
+TIPOS_VALIDOS = TIPOS_NUMERICOS + ("boolean",)
+
+class PlantillaInvalida(ValueError):
+    pass
+
+def _congelar(obj):
+    """Copia profunda de solo lectura (dict → MappingProxyType, list → tuple)."""
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _congelar(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(_congelar(v) for v in obj)
+    return obj
+
+def descongelar(obj):
+    """Inversa de _congelar: devuelve dict/list mutables (para payloads JSON)."""
+    if isinstance(obj, MappingProxyType):
+        return {k: descongelar(v) for k, v in obj.items()}
+    if isinstance(obj, tuple):
+        return [descongelar(v) for v in obj]
+    return obj
+
+@dataclass(frozen=True)
+class ReglaParametro:
+    """Regla de un parámetro ya validada, con rango y variación precalculados."""
+    nombre: str
+    tipo: str
+    min: float = 0
+    max: float = 1
+    variacion: float = 1
+    prob_flip: float = 0.01
+    default: object = None
+    senal: object = field(default=None, compare=False)  # modelo de signals.py (None = paseo aleatorio)
+
+    @property
+    def es_float(self):
+        return self.tipo in ("float", "double")
+
+    @property
+    def es_int(self):
+        return self.tipo == "int"
+
+    @property
+    def es_bool(self):
+        return self.tipo == "boolean"
+
+    def acotar(self, v):
+        """Lleva un valor producido por la señal al tipo y rango de la regla."""
+        if self.es_float:
+            return round(min(self.max, max(self.min, v)), 3)
+        if self.es_int:
+            return int(round(min(self.max, max(self.min, v))))
+        return v
+
+def _compilar_senal(nombre, rule, tipo):
+    try:
+        senal = compilar_senal(rule.get("senal"))
+    except SenalInvalida as e:
+        raise PlantillaInvalida(f"parámetro '{nombre}': {e}")
+    if senal is not None and tipo == "boolean" and not isinstance(senal, Markov):
+        raise PlantillaInvalida(f"parámetro '{nombre}': un booleano solo admite la señal 'markov'")
+    return senal
+
+def compilar_regla(nombre, rule):
+    if not isinstance(rule, dict):
+        raise PlantillaInvalida(f"parámetro '{nombre}': la regla debe ser un objeto")
+    t = rule.get("tipo")
+    if t is not None and not isinstance(t, str):
+        raise PlantillaInvalida(f"parámetro '{nombre}': 'tipo' inválido")
+
+    if t in TIPOS_NUMERICOS:
+        mn = rule.get("min", 0)
+        mx = rule.get("max", 1)
+        if not isinstance(mn, (int, float)) or not isinstance(mx, (int, float)) or mn > mx:
+            raise PlantillaInvalida(f"parámetro '{nombre}': rango min/max inválido ({mn}, {mx})")
+        if t == "int":
+            mn, mx = int(mn), int(mx)
+            var = int(rule.get("variacion", 1))
+        else:
+            mn, mx = float(mn), float(mx)
+            var = float(rule.get("variacion", (mx - mn) * 0.05))
+        if var < 0:
+            raise PlantillaInvalida(f"parámetro '{nombre}': 'variacion' no puede ser negativa")
+        return ReglaParametro(nombre, t, mn, mx, var, default=rule.get("default"),
+                              senal=_compilar_senal(nombre, rule, t))
+
+    if t == "boolean":
+        prob = float(rule.get("prob_flip", 0.01))
+        if not 0.0 <= prob <= 1.0:
+            raise PlantillaInvalida(f"parámetro '{nombre}': 'prob_flip' debe estar en [0, 1]")
+        return ReglaParametro(nombre, t, prob_flip=prob, default=rule.get("default"),
+                              senal=_compilar_senal(nombre, rule, t))
+
+    # tipo desconocido → valor fijo 'default'
+    if rule.get("senal") is not None:
+        raise PlantillaInvalida(f"parámetro '{nombre}': 'senal' solo aplica a parámetros numéricos o booleanos")
+    return ReglaParametro(nombre, t or "", default=rule.get("default"))
+
+def compilar_reglas(parametros_rules):
+    """dict {nombre: regla} → tupla de ReglaParametro (acepta también reglas ya compiladas)."""
+    if not parametros_rules:
+        return ()
+    if isinstance(parametros_rules, (tuple, list)):
+        return tuple(parametros_rules)
+    reglas = [compilar_regla(k, r) for k, r in parametros_rules.items()]
+    return _ordenar_dependencias(reglas)
+
+def _ordenar_dependencias(reglas):
+    """Las señales 'correlado' se evalúan después del parámetro que siguen (mismo tick)."""
+    por_nombre = {r.nombre: r for r in reglas}
+    nombres = set(por_nombre)
+    pendientes = list(reglas)
+    orden, hechos = [], set()
+    while pendientes:
+        resto = []
+        for r in pendientes:
+            dep = r.senal.depende_de if r.senal is not None else None
+            if dep is not None and dep not in nombres:
+                raise PlantillaInvalida(f"parámetro '{r.nombre}': sigue a '{dep}', que no existe")
+            if dep is not None:
+                objetivo = por_nombre[dep]
+                if not (objetivo.es_float or objetivo.es_int or objetivo.es_bool):
+                    raise PlantillaInvalida(f"parámetro '{r.nombre}': sigue a '{dep}', que no es numérico ni booleano")
+            if dep is None or dep in hechos:
+                orden.append(r)
+                hechos.add(r.nombre)
+            else:
+                resto.append(r)
+        if len(resto) == len(pendientes):
+            raise PlantillaInvalida(f"dependencias circulares entre señales: {', '.join(r.nombre for r in resto)}")
+        pendientes = resto
+    return tuple(orden)
+
+class Plantilla:
+    """
+    Plantilla validada e inmutable. Expone los campos crudos (solo lectura) vía
+    .get()/[] para compatibilidad con el código que trataba las plantillas como dict.
+    """
+    __slots__ = ("nombre_archivo", "serial_prefix", "kind", "capability", "canal",
+                 "intervalo", "reglas", "reglas_por_nombre", "datos")
+
+    def __init__(self, nombre_archivo, data):
+        if not isinstance(data, dict):
+            raise PlantillaInvalida("la plantilla debe ser un objeto JSON")
+        prefix = data.get("serial_prefix", "DEV")
+        if not isinstance(prefix, str) or not prefix:
+            raise PlantillaInvalida("'serial_prefix' inválido")
+        cfg = data.get("configuracion", {}) or {}
+        if not isinstance(cfg, dict):
+            raise PlantillaInvalida("'configuracion' debe ser un objeto")
+        try:
+            intervalo = max(1, int(cfg.get("intervalo_envio", 5)))
+        except (TypeError, ValueError):
+            raise PlantillaInvalida("'intervalo_envio' inválido")
+
+        kind = guess_kind(prefix, cfg)
+        s = object.__setattr__
+        s(self, "nombre_archivo", nombre_archivo)
+        s(self, "serial_prefix", prefix)
+        s(self, "kind", kind)
+        s(self, "capability", cfg.get("capability") or capability_for_kind(kind))
+        s(self, "canal", channel_for_kind(kind))
+        s(self, "intervalo", intervalo)
+        reglas = compilar_reglas(data.get("parametros", {}) or {})
+        s(self, "reglas", reglas)
+        s(self, "reglas_por_nombre", MappingProxyType({r.nombre: r for r in reglas}))
+        s(self, "datos", _congelar(data))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Plantilla es inmutable")
+
+    def get(self, key, default=None):
+        return self.datos.get(key, default)
+
+    def __getitem__(self, key):
+        return self.datos[key]
+
+    def __contains__(self, key):
+        return key in self.datos
+
+    @property
+    def capabilities(self):
+        """Lista "capabilities" de la plantilla como JSON plano ([] si no la declara)."""
+        return descongelar(self.get("capabilities") or ())
+
+    def payload_reclamo(self):
+        """Datos mínimos para reclamar un dispositivo de esta plantilla (sin serial)."""
+        return {
+            "nombre": self.get("nombre", ""),
+            "tipo": self.get("tipo", ""),
+            "modelo": self.get("modelo", ""),
+            "descripcion": self.get("descripcion", ""),
+            "configuracion": descongelar(self.get("configuracion", {}) or {}),
+        }
+
+    def __repr__(self):
+        return f"Plantilla({self.nombre_archivo!r}, prefix={self.serial_prefix!r})"
+
+class IndicePlantillas(dict):
+    """
+    nombre → Plantilla, con índice por serial_prefix para búsquedas O(1).
+    """
+    def __init__(self, plantillas=None):
+        super().__init__()
+        self._por_prefijo = {}
+        self._prefix_lens = ()
+        for nombre, tpl in (plantillas or {}).items():
+            self[nombre] = tpl
+
+    def __setitem__(self, nombre, tpl):
+        anterior = self.get(nombre)
+        if anterior is not None and self._por_prefijo.get(anterior.serial_prefix) is anterior:
+            del self._por_prefijo[anterior.serial_prefix]
+        super().__setitem__(nombre, tpl)
+        self._por_prefijo[tpl.serial_prefix] = tpl
+        self._recalcular_lens()
+
+    def __delitem__(self, nombre):
+        tpl = self[nombre]
+        super().__delitem__(nombre)
+        if self._por_prefijo.get(tpl.serial_prefix) is tpl:
+            del self._por_prefijo[tpl.serial_prefix]
+        self._recalcular_lens()
+
+    def _recalcular_lens(self):
+        self._prefix_lens = tuple(sorted({len(p) for p in self._por_prefijo}, reverse=True))
+
+    def por_prefijo(self, prefix):
+        return self._por_prefijo.get(prefix)
+
+    def para_serial(self, serial):
+        """Plantilla cuyo serial_prefix coincide con el inicio del serial (o None)."""
+        s = str(serial)
+        for n in self._prefix_lens:
+            tpl = self._por_prefijo.get(s[:n])
+            if tpl is not None:
+                return tpl
+        return None
+
+def cargar_plantilla(ruta, nombre=None):
+    nombre = nombre or os.path.basename(ruta).replace(".json", "")
+    with open(ruta, "r", encoding="utf-8") as f:
+        return Plantilla(nombre, json.load(f))
+
 def cargar_plantillas():
-    plantillas = {}
+    plantillas = IndicePlantillas()
     if not os.path.isdir(TEMPLATE_DIR):
         return plantillas
-    for archivo in os.listdir(TEMPLATE_DIR):
+    for archivo in sorted(os.listdir(TEMPLATE_DIR)):
         if archivo.endswith(".json"):
             nombre = archivo.replace(".json", "")
             ruta = os.path.join(TEMPLATE_DIR, archivo)
-            with open(ruta, "r", encoding="utf-8") as f:
-                plantillas[nombre] = json.load(f)
+            try:
+                plantillas[nombre] = cargar_plantilla(ruta, nombre)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Plantilla inválida '{archivo}': {e}")
     return plantillas
@@ -0,0 +1,254 @@
+# trace_monitor.py
+"""
+Suscriptor local para medir latencia y pérdida de extremo a extremo.
+
+Requiere "tracing": true en config.json: cada payload lleva
+  "traza": {"seq": n, "ts_ns": hora de envío en ns, "plantilla": nombre}
+El monitor se suscribe al tópico de estado en uno o varios brokers y calcula,
+por plantilla y por dispositivo:
+  - latencia (recepción − ts_ns) p50 / p95 / p99 en ms
+  - huecos: seq que faltan (seq > último + 1)
+  - duplicados: seq ya recibida
+  - reordenados: seq que llega después de una mayor (rellena un hueco)
+En modo gateway cada lote se desarma y sus lecturas se cuentan una a una.
+
+La latencia usa el reloj de pared de ambos lados: en la misma máquina es
+exacta; entre máquinas depende de su sincronización (NTP).
+
+Uso:
+  python trace_monitor.py                         # brokers y tópico de config.json
+  python trace_monitor.py --broker localhost:1883 --broker localhost:1884 --duracion 60 --csv traza.csv
+"""
+import argparse
+import csv
+import json
+import random
+import threading
+import time
+from collections import deque
+
+VENTANA_DUPLICADOS = 4096   # seq recientes recordadas por dispositivo
+MAX_LATENCIAS = 200000      # muestras de latencia guardadas por grupo (reservorio)
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return None
+    k = min(len(ordenados) - 1, max(0, int(round(p / 100.0 * (len(ordenados) - 1)))))
+    return ordenados[k]
+
+class _Grupo:
+    """Acumulados de un dispositivo o de una plantilla."""
+    __slots__ = ("recibidos", "huecos", "duplicados", "reordenados", "latencias", "_n_lat")
+
+    def __init__(self):
+        self.recibidos = 0
+        self.huecos = 0
+        self.duplicados = 0
+        self.reordenados = 0
+        self.latencias = []
+        self._n_lat = 0
+
+    def agregar_latencia(self, ms, rng):
+        self._n_lat += 1
+        if len(self.latencias) < MAX_LATENCIAS:
+            self.latencias.append(ms)
+        else:
+            j = rng.randrange(self._n_lat)
+            if j < MAX_LATENCIAS:
+                self.latencias[j] = ms
+
+    def resumen(self):
+        lat = sorted(self.latencias)
+        esperados = self.recibidos - self.duplicados + self.huecos
+        return {
+            "recibidos": self.recibidos,
+            "perdidos": self.huecos,
+            "perdida_pct": round(self.huecos * 100.0 / esperados, 3) if esperados else 0.0,
+            "duplicados": self.duplicados,
+            "reordenados": self.reordenados,
+            "p50_ms": percentil(lat, 50),
+            "p95_ms": percentil(lat, 95),
+            "p99_ms": percentil(lat, 99),
+        }
+
+class _Dispositivo(_Grupo):
+    __slots__ = ("plantilla", "max_seq", "vistos", "_orden")
+
+    def __init__(self, plantilla):
+        super().__init__()
+        self.plantilla = plantilla
+        self.max_seq = 0
+        self.vistos = set()
+        self._orden = deque()
+
+class EstadisticasTraza:
+    def __init__(self):
+        self._rng = random.Random(0)
+        self._lock = threading.Lock()
+        self.dispositivos = {}   # serial -> _Dispositivo
+        self.plantillas = {}     # nombre -> _Grupo
+        self.sin_traza = 0
+        self.invalidos = 0
+        self.lotes = 0           # mensajes de gateway (cada lectura se cuenta aparte)
+
+    def registrar(self, payload, recibido_ns=None):
+        """Procesa un payload (bytes/str/dict)."""
+        recibido_ns = recibido_ns or time.time_ns()
+        try:
+            msg = payload if isinstance(payload, dict) else json.loads(payload)
+            lecturas = msg.get("lecturas")
+            if isinstance(lecturas, list):
+                # lote de un gateway (ver gateways.py): la latencia incluye la ventana del lote
+                self.lotes += 1
+                for lectura in lecturas:
+                    self.registrar(lectura, recibido_ns)
+                return
+            traza = msg.get("traza")
+            serial = msg["serial_number"]
+        except (ValueError, KeyError, AttributeError, TypeError):
+            self.invalidos += 1
+            return
+        if not isinstance(traza, dict) or "seq" not in traza:
+            self.sin_traza += 1
+            return
+        seq = int(traza["seq"])
+        plantilla = traza.get("plantilla") or "-"
+        ms = (recibido_ns - int(traza.get("ts_ns", recibido_ns))) / 1e6
+
+        with self._lock:
+            d = self.dispositivos.get(serial)
+            if d is None:
+                d = self.dispositivos[serial] = _Dispositivo(plantilla)
+            g = self.plantillas.get(d.plantilla)
+            if g is None:
+                g = self.plantillas[d.plantilla] = _Grupo()
+            for grupo in (d, g):
+                grupo.recibidos += 1
+
+            if seq in d.vistos:
+                d.duplicados += 1
+                g.duplicados += 1
+                return
+            d.vistos.add(seq)
+            d._orden.append(seq)
+            if len(d._orden) > VENTANA_DUPLICADOS:
+                d.vistos.discard(d._orden.popleft())
+
+            if d.max_seq == 0:
+                pass  # primer mensaje visto: el monitor pudo arrancar a mitad de la corrida
+            elif seq > d.max_seq + 1:
+                faltan = seq - d.max_seq - 1
+                d.huecos += faltan
+                g.huecos += faltan
+            elif seq < d.max_seq:
+                # llegó tarde: no es pérdida, rellena un hueco contado antes
+                d.reordenados += 1
+                g.reordenados += 1
+                d.huecos = max(0, d.huecos - 1)
+                g.huecos = max(0, g.huecos - 1)
+            d.max_seq = max(d.max_seq, seq)
+
+            d.agregar_latencia(ms, self._rng)
+            g.agregar_latencia(ms, self._rng)
+
+    def reporte(self, top=10):
+        with self._lock:
+            plantillas = {k: g.resumen() for k, g in sorted(self.plantillas.items())}
+            peores = sorted(self.dispositivos.items(), key=lambda kv: kv[1].huecos, reverse=True)[:top]
+            peores = [(s, d.plantilla, d.resumen()) for s, d in peores if d.huecos]
+            n_disp = len(self.dispositivos)
+
+        def fmt(v):
+            return "-" if v is None else f"{v:.1f}"
+
+        lineas = [f"=== Trazas: {n_disp} dispositivos | sin traza: {self.sin_traza} | inválidos: {self.invalidos}"
+                  + (f" | lotes de gateway: {self.lotes}" if self.lotes else "") + " ==="]
+        lineas.append(f"{'plantilla':<22}{'recib.':>9}{'perd.':>8}{'perd.%':>8}{'dup.':>6}{'reord.':>7}"
+                      f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for nombre, r in plantillas.items():
+            lineas.append(f"{nombre:<22}{r['recibidos']:>9}{r['perdidos']:>8}{r['perdida_pct']:>8.2f}"
+                          f"{r['duplicados']:>6}{r['reordenados']:>7}"
+                          f"{fmt(r['p50_ms']):>9}{fmt(r['p95_ms']):>9}{fmt(r['p99_ms']):>9}")
+        if peores:
+            lineas.append(f"--- dispositivos con más pérdida (top {top}) ---")
+            for serial, plantilla, r in peores:
+                lineas.append(f"{serial} ({plantilla}): perdidos {r['perdidos']} ({r['perdida_pct']:.2f}%), "
+                              f"dup {r['duplicados']}, reord {r['reordenados']}, p99 {fmt(r['p99_ms'])} ms")
+        return "\n".join(lineas)
+
+    def exportar_csv(self, ruta):
+        with self._lock:
+            filas = [(s, d.plantilla, d.resumen()) for s, d in sorted(self.dispositivos.items())]
+        campos = ["recibidos", "perdidos", "perdida_pct", "duplicados", "reordenados", "p50_ms", "p95_ms", "p99_ms"]
+        with open(ruta, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["serial", "plantilla"] + campos)
+            for serial, plantilla, r in filas:
+                w.writerow([serial, plantilla] + [r[c] for c in campos])
+        print(f"📄 Detalle por dispositivo en {ruta}")
+
+# ---------------- Suscripción MQTT ----------------
+def _brokers_de_config(config):
+    from sharding import parsear_broker
+    puerto = config.get("mqtt_port", 1883)
+    brokers = config.get("mqtt_brokers") or [(config.get("mqtt_host", "localhost"), puerto)]
+    return [parsear_broker(b, puerto) for b in brokers]
+
+def monitorear(brokers, topic, stats, duracion=None, cada=10.0):
+    from paho.mqtt import client as mqtt_client
+
+    def on_message(client, userdata, msg):
+        stats.registrar(msg.payload, time.time_ns())
+
+    clientes = []
+    for host, port in brokers:
+        try:
+            c = mqtt_client.Client(mqtt_client.CallbackAPIVersion.VERSION2)
+        except AttributeError:  # paho-mqtt < 2.0
+            c = mqtt_client.Client()
+        c.on_connect = lambda client, *a, t=topic: client.subscribe(t, qos=0)
+        c.on_message = on_message
+        c.connect_async(host, port)
+        c.loop_start()
+        clientes.append(c)
+        print(f"👂 Escuchando {topic} en {host}:{port}")
+
+    fin = time.monotonic() + duracion if duracion else None
+    try:
+        while fin is None or time.monotonic() < fin:
+            time.sleep(max(0.0, min(cada, fin - time.monotonic())) if fin else cada)
+            print(stats.reporte())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for c in clientes:
+            c.loop_stop()
+            c.disconnect()
+
+def main(argv=None):
+    from config_loader import get_config
+    config = get_config()
+    parser = argparse.ArgumentParser(description="Monitor de latencia y pérdida (requiere tracing en config.json)")
+    parser.add_argument("--broker", action="append", help="host:puerto (repetible; por defecto los de config.json)")
+    if config.get("gateway_mode"):
+        topic = config.get("mqtt_topic_gateway", "gateways/{gateway}/estado").replace("{gateway}", "+")
+    else:
+        topic = config.get("mqtt_topic_estado", "dispositivos/estado")
+    parser.add_argument("--topic", default=topic)
+    parser.add_argument("--duracion", type=float, default=None, help="segundos (por defecto hasta Ctrl+C)")
+    parser.add_argument("--cada", type=float, default=10.0, help="segundos entre reportes")
+    parser.add_argument("--csv", help="archivo CSV con el detalle por dispositivo al terminar")
+    args = parser.parse_args(argv)
+
+    from sharding import parsear_broker
+    brokers = [parsear_broker(b) for b in args.broker] if args.broker else _brokers_de_config(config)
+    if not config.get("tracing"):
+        print("⚠️ 'tracing' está desactivado en config.json: los payloads no traerán traza")
+    stats = EstadisticasTraza()
+    monitorear(brokers, args.topic, stats, args.duracion, args.cada)
+    print(stats.reporte())
+    if args.csv:
+        stats.exportar_csv(args.csv)
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,69 @@
 # utils.py
-import random
 import string
 import subprocess
 import json
 import os
-import requests
 import tempfile
-from requests.exceptions import RequestException, Timeout, ConnectionError
+from itertools import repeat
+
+from config_loader import get_config
+from semillas import flujo_compartido
 
 SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), "scripts")
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
 DEFAULT_TIMEOUT = 5  # segundos
 
 # ---------------- Config ----------------
-def load_config():
-    try:
-        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"⚠️ No se pudo cargar config.json: {e}")
-        return {}
-
 def get_backend_url(path=""):
-    config = load_config()
-    base_url = config.get("backend_url", "http://localhost:5000").rstrip("/")
+    base_url = (get_config().get("backend_url") or "http://localhost:5000").rstrip("/")
     if path:
         return f"{base_url}/{path.lstrip('/')}"
     return base_url
 
 # ---------------- Utils varias ----------------
-def generar_serial(prefix="DEV", length=8):
-    rand_part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
-    return f"{prefix}{rand_part}"
+SERIAL_ALFABETO = string.ascii_uppercase + string.digits
+_SERIAL_PARES = [a + b for a in SERIAL_ALFABETO for b in SERIAL_ALFABETO]  # 36² = 1296
+
+def _codificar_base36(nums, prefix, length):
+    """Codifica enteros (< 36^length) como prefix + base 36, por columnas de dos caracteres."""
+    pares = length // 2
+    tabla = _SERIAL_PARES
+    columnas = [[tabla[x // d % 1296] for x in nums] for d in (1296 ** i for i in range(pares - 1, -1, -1))]
+    if length % 2:
+        d = 1296 ** pares
+        columnas.insert(0, [SERIAL_ALFABETO[x // d % 36] for x in nums])
+    return list(map("".join, zip(repeat(prefix), *columnas)))
+
+def generar_seriales(prefix="DEV", count=1, existentes=None, length=8):
+    """
+    Genera 'count' seriales únicos (entre sí y respecto a 'existentes') en bloque:
+    enteros aleatorios de ~log2(36^length) bits deduplicados con un set y
+    codificados en base 36.
+    """
+    if count <= 0:
+        return []
+    bits = (36 ** length).bit_length() - 1   # 2^bits <= 36^length
+    if count > 2 ** bits // 2:
+        raise ValueError(f"No hay suficientes seriales libres de {length} caracteres para {count} dispositivos")
+
+    getrandbits = flujo_compartido("seriales", prefix).getrandbits
+    usados = set()
+    seriales = []
+    while len(seriales) < count:
+        faltan = count - len(seriales)
+        nuevos = {getrandbits(bits) for _ in range(faltan)} - usados
+        usados |= nuevos
+        candidatos = _codificar_base36(nuevos, prefix, length)
+        if existentes:
+            candidatos = [s for s in candidatos if s not in existentes]
+        seriales.extend(candidatos)
+    return seriales
 
 def clamp(v, mn, mx):
     return max(mn, min(mx, v))
 
 def listar_dispositivos_backend():
+    import requests  # se carga al primer uso (arranque más rápido)
+    from requests.exceptions import RequestException, Timeout, ConnectionError
     try:
         resp = requests.get(get_backend_url("dispositivos"), timeout=DEFAULT_TIMEOUT)
         if resp.status_code == 200:
@@ -55,23 +82,15 @@ def _strip_schedule_channels(cfg: dict):
 
 # ---------------- Opción 10: Reclamar dispositivo ----------------
 def reclamar_dispositivo(serial, templates):
-    prefix = serial[:4]
-    template = next((t for t in templates if t.get("serial_prefix") == prefix), None)
+    """templates: IndicePlantillas (búsqueda O(1) por serial_prefix)."""
+    template = templates.para_serial(serial)
 
     if not template:
-        print(f"❌ No se encontró template para prefijo {prefix}")
+        print(f"❌ No se encontró template para prefijo {serial[:4]}")
         return
 
-    payload = {
-        "serial_number": serial,
-        "nombre": template.get("nombre", ""),
-        "tipo": template.get("tipo", ""),
-        "modelo": template.get("modelo", ""),
-        "descripcion": template.get("descripcion", ""),
-        "configuracion": template.get("configuracion", {}) or {},
-        # Si empiezas a usar capabilities en las plantillas
-        "capabilities": template.get("capabilities", [])
-    }
+    payload = {"serial_number": serial, **template.payload_reclamo(),
+               "capabilities": template.capabilities}
 
     # Guardamos el payload en un archivo temporal y se lo pasamos al .ps1
     try: